@@ -2,30 +2,35 @@
 # Ce script télécharge une archive ZIP depuis une URL, l'extrait localement
 # dans un dossier 'data/raw/', avec nettoyage des noms de fichiers pour éviter
 # tout problème d'upload futur vers MinIO/S3. Tous les événements sont journalisés.
+#
+# Le téléchargement est streamé par blocs dans un fichier temporaire sur disque
+# (mémoire constante), reprend après coupure via des requêtes HTTP Range, et
+# utilise un GET conditionnel (ETag / Last-Modified) pour ne pas retélécharger
+# une archive inchangée.
+#
+# L'extraction streame chaque membre via ZipFile.open() par blocs de taille fixe,
+# en parallèle sur un pool de threads. Avec EXTRACT_SINK=minio, chaque flux est
+# envoyé directement dans MinIO sous 'data/raw/' (upload multipart) sans passer
+# par le disque local.
 
 import requests
-from zipfile import ZipFile
-from io import BytesIO
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from zipfile import ZipFile, ZipInfo
 from pathlib import Path
 import unicodedata
 import re
 from loguru import logger
 import sys
 import warnings
+from common import setup_logger
+from storage import get_s3_client, BUCKET_NAME, TRANSFER_CONFIG
 
 warnings.filterwarnings("ignore")
 
-# ==============================================================================
-# Configuration des logs
-# ==============================================================================
-logger.remove()
-logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
-logger.add(sys.stderr, level="WARNING")
-
-LOGS_PATH = Path("logs")
-LOGS_PATH.mkdir(parents=True, exist_ok=True)
-logger.add(LOGS_PATH / "download_extract.log", level="INFO", rotation="500 KB")
-
 # ==============================================================================
 # Paramètres du téléchargement
 # ==============================================================================
@@ -34,7 +39,21 @@ ZIP_URL = (
     "922_P10/bottleneck.zip"
 )
 RAW_PATH = Path("data/raw")    # Répertoire cible des fichiers extraits
-RAW_PATH.mkdir(parents=True, exist_ok=True)
+
+ARCHIVE_PATH = Path("data/archive/bottleneck.zip")        # Archive complète conservée
+PARTIAL_PATH = ARCHIVE_PATH.with_name("bottleneck.zip.part")  # Téléchargement en cours
+METADATA_PATH = ARCHIVE_PATH.with_name("bottleneck.zip.json")  # ETag / Last-Modified
+
+CHUNK_SIZE = 1024 * 1024   # Taille des blocs écrits sur disque (1 Mo)
+MAX_ATTEMPTS = 5           # Nombre de tentatives (avec reprise) avant abandon
+TIMEOUT = (10, 60)         # Timeouts connexion / lecture (secondes)
+
+# ==============================================================================
+# Paramètres de l'extraction
+# ==============================================================================
+EXTRACT_SINK = os.getenv("EXTRACT_SINK", "local")   # "local" ou "minio"
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)       # Membres extraits en parallèle
+DESTINATION_PREFIX = "data/raw/"
 
 # ==============================================================================
 # Fonction utilitaire : normalisation sécurisée des noms de fichiers
@@ -46,63 +65,190 @@ def normalize_filename(filename: str) -> str:
     return safe
 
 # ==============================================================================
-# Étape 1 : Téléchargement de l'archive ZIP
+# Fonctions utilitaires : téléchargement streamé, reprenable et conditionnel
 # ==============================================================================
-logger.info("📦 Début du téléchargement de l'archive ZIP...")
-
-try:
-    response = requests.get(ZIP_URL)
-    response.raise_for_status()
-    logger.success("✅ Archive ZIP téléchargée avec succès.")
-except Exception as e:
-    logger.error(f"❌ Erreur lors du téléchargement : {e}")
-    sys.exit(1)
+def load_metadata() -> dict:
+    if METADATA_PATH.exists():
+        return json.loads(METADATA_PATH.read_text())
+    return {}
+
+
+def save_metadata(metadata: dict) -> None:
+    METADATA_PATH.write_text(json.dumps(metadata, indent=2))
+
+
+def build_headers(metadata: dict, offset: int) -> dict:
+    headers = {}
+    validator = metadata.get("etag") or metadata.get("last_modified")
+
+    if offset > 0:
+        # Reprise : If-Range garantit qu'on complète bien la même version
+        headers["Range"] = f"bytes={offset}-"
+        if validator:
+            headers["If-Range"] = validator
+    elif ARCHIVE_PATH.exists() and metadata.get("complete"):
+        # GET conditionnel : 304 si l'archive distante n'a pas changé
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+    return headers
+
+
+def download_archive(url: str) -> bool:
+    # Retourne True si une nouvelle archive a été téléchargée, False si inchangée.
+    ARCHIVE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    metadata = load_metadata()
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        offset = PARTIAL_PATH.stat().st_size if PARTIAL_PATH.exists() else 0
+        headers = build_headers(metadata, offset)
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code == 304:
+                    return False
+
+                if response.status_code == 416:
+                    # Plage invalide (fichier partiel corrompu) : on repart de zéro
+                    PARTIAL_PATH.unlink(missing_ok=True)
+                    continue
+
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    mode = "ab"
+                    logger.info(f"⏯️  Reprise du téléchargement à l'octet {offset}")
+                else:
+                    # 200 : contenu complet (nouvelle version ou Range ignoré)
+                    mode, offset = "wb", 0
+                    metadata = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "complete": False,
+                    }
+                    save_metadata(metadata)
+
+                content_length = response.headers.get("Content-Length")
+                expected_size = offset + int(content_length) if content_length else None
+
+                with open(PARTIAL_PATH, mode) as f_out:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f_out.write(chunk)
+
+            if expected_size is not None and PARTIAL_PATH.stat().st_size < expected_size:
+                raise IOError(
+                    f"Téléchargement incomplet : {PARTIAL_PATH.stat().st_size}/{expected_size} octets"
+                )
+
+            PARTIAL_PATH.replace(ARCHIVE_PATH)
+            metadata["complete"] = True
+            save_metadata(metadata)
+            return True
+
+        except (requests.RequestException, IOError) as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            logger.warning(f"⚠️ Tentative {attempt}/{MAX_ATTEMPTS} interrompue : {e}")
+            time.sleep(2 ** attempt)
+
+    raise IOError(f"Échec du téléchargement après {MAX_ATTEMPTS} tentatives")
 
 # ==============================================================================
-# Étape 2 : Extraction sécurisée du contenu de l'archive
+# Fonctions utilitaires : extraction streamée et parallèle
 # ==============================================================================
-logger.info("📂 Début de l'extraction de l'archive...")
-
-try:
-    with ZipFile(BytesIO(response.content)) as zip_ref:
-        for member in zip_ref.infolist():
-            original_name = Path(member.filename).name
-            if not original_name:
-                continue  # Ignore les répertoires vides
-
-            safe_name = normalize_filename(original_name)
-            target_path = RAW_PATH / safe_name
-
-            # Écriture sécurisée
-            with open(target_path, "wb") as f_out:
-                f_out.write(zip_ref.read(member))
-            
+def extract_member(member: ZipInfo, s3_client=None) -> str:
+    # Chaque worker ouvre sa propre poignée sur l'archive (lectures indépendantes)
+    safe_name = normalize_filename(Path(member.filename).name)
+
+    with ZipFile(ARCHIVE_PATH) as zip_ref, zip_ref.open(member) as f_in:
+        if s3_client is not None:
+            s3_client.upload_fileobj(
+                f_in, BUCKET_NAME, f"{DESTINATION_PREFIX}{safe_name}", Config=TRANSFER_CONFIG
+            )
+        else:
+            with open(RAW_PATH / safe_name, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+
+    return safe_name
+
+
+def extract_archive(s3_client=None) -> list[str]:
+    with ZipFile(ARCHIVE_PATH) as zip_ref:
+        # Ignore les répertoires vides
+        members = [m for m in zip_ref.infolist() if not m.is_dir() and Path(m.filename).name]
+
+    extracted = []
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        futures = [executor.submit(extract_member, member, s3_client) for member in members]
+        for future in as_completed(futures):
+            safe_name = future.result()
+            extracted.append(safe_name)
             logger.info(f"✅ Fichier extrait et normalisé : {safe_name}")
-
-    logger.success(f"✅ Extraction complète vers '{RAW_PATH.resolve()}'")
-except Exception as e:
-    logger.error(f"❌ Erreur lors de l'extraction : {e}")
-    sys.exit(1)
+    return extracted
 
 # ==============================================================================
-# Étape 3 : Validation finale de la présence des fichiers attendus
+# Point d'entrée de l'étape
 # ==============================================================================
-expected_files = [
-    "Fichier_erp.xlsx",
-    "Fichier_web.xlsx",
-    "fichier_liaison.xlsx",
-]
-expected_files_normalized = [normalize_filename(f) for f in expected_files]
-
-missing_files = [f for f in expected_files_normalized if not (RAW_PATH / f).exists()]
-
-if missing_files:
-    logger.error(f"❌ Fichiers manquants après extraction : {missing_files}")
-    sys.exit(1)
-
-logger.success("🎯 Tous les fichiers Excel attendus sont présents après extraction :")
-for f in expected_files_normalized:
-    logger.info(f"   - {f}")
-
-logger.success("🎉 Téléchargement et extraction terminés sans erreur.")
-
+def main(s3_client=None) -> None:
+    setup_logger("download_extract.log")
+    RAW_PATH.mkdir(parents=True, exist_ok=True)
+
+    # ==========================================================================
+    # Étape 1 : Téléchargement de l'archive ZIP
+    # ==========================================================================
+    logger.info("📦 Début du téléchargement de l'archive ZIP...")
+
+    try:
+        if download_archive(ZIP_URL):
+            size_mb = ARCHIVE_PATH.stat().st_size / 1024 / 1024
+            logger.success(f"✅ Archive ZIP téléchargée avec succès ({size_mb:.1f} Mo).")
+        else:
+            logger.info("♻️  Archive ZIP inchangée depuis le dernier téléchargement (304).")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du téléchargement : {e}")
+        sys.exit(1)
+
+    # ==========================================================================
+    # Étape 2 : Extraction sécurisée du contenu de l'archive
+    # ==========================================================================
+    logger.info("📂 Début de l'extraction de l'archive...")
+
+    try:
+        if EXTRACT_SINK == "minio":
+            if s3_client is None:
+                s3_client = get_s3_client()
+            extracted = extract_archive(s3_client)
+            logger.success(f"✅ Extraction complète vers '{BUCKET_NAME}/{DESTINATION_PREFIX}'")
+        else:
+            extracted = extract_archive()
+            logger.success(f"✅ Extraction complète vers '{RAW_PATH.resolve()}'")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'extraction : {e}")
+        sys.exit(1)
+
+    # ==========================================================================
+    # Étape 3 : Validation finale de la présence des fichiers attendus
+    # ==========================================================================
+    expected_files = [
+        "Fichier_erp.xlsx",
+        "Fichier_web.xlsx",
+        "fichier_liaison.xlsx",
+    ]
+    expected_files_normalized = [normalize_filename(f) for f in expected_files]
+
+    missing_files = [f for f in expected_files_normalized if f not in extracted]
+
+    if missing_files:
+        logger.error(f"❌ Fichiers manquants après extraction : {missing_files}")
+        sys.exit(1)
+
+    logger.success("🎯 Tous les fichiers Excel attendus sont présents après extraction :")
+    for f in expected_files_normalized:
+        logger.info(f"   - {f}")
+
+    logger.success("🎉 Téléchargement et extraction terminés sans erreur.")
+
+
+if __name__ == "__main__":
+    main()
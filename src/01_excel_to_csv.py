@@ -1,36 +1,47 @@
-# === Script 01 - Conversion de fichiers Excel en CSV (robuste et sécurisé) ===
-# Ce script convertit les fichiers Excel extraits en fichiers CSV,
-# en assurant un nettoyage minimal des données et une journalisation claire.
-
+# === Script 01 - Ingestion des fichiers Excel dans DuckDB (et export CSV optionnel) ===
+# Ce script charge les fichiers Excel extraits en tables Arrow (lecteur calamine),
+# applique un nettoyage minimal (lignes/colonnes vides) et les enregistre
+# directement dans 'data/bottleneck.duckdb' sous forme de tables erp_raw,
+# web_raw et liaison_raw, sans passer par un CSV intermédiaire.
+# Les trois classeurs sont convertis en parallèle dans des processus séparés.
+# Les colonnes sont contrôlées et typées selon le registre 'schemas.py'.
+# L'export CSV (data/raw/*.csv, archivé dans MinIO par le script 02) reste
+# disponible via EXPORT_RAW_CSV=1 (valeur par défaut, voir common.py).
+# Avec EXTRACT_SINK=minio, le script 00 n'écrit rien en local : les classeurs sont
+# d'abord téléchargés depuis MinIO (data/raw/).
+
+import importlib.util
+import os
 import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from loguru import logger
 import sys
 import warnings
+from common import setup_logger, connect_duckdb, EXPORT_RAW_CSV
+from schemas import SCHEMAS, check_columns, check_relation, cast_projection
+from storage import download_files, TransferError
+from metrics import record_metrics, record_transfer
 
 warnings.filterwarnings("ignore")
 
-# ==============================================================================
-# Configuration des logs
-# ==============================================================================
-logger.remove()
-logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
-logger.add(sys.stderr, level="WARNING")
-
-LOGS_PATH = Path("logs")
-LOGS_PATH.mkdir(parents=True, exist_ok=True)
-logger.add(LOGS_PATH / "conversion_excel_csv.log", level="INFO", rotation="500 KB")
-
 # ==============================================================================
 # Chemins d'entrée (fichiers Excel) et de sortie (fichiers CSV)
 # ==============================================================================
 EXTRACTED_PATH = Path("data/raw")   # 📂 Contient les fichiers .xlsx extraits
-CSV_OUTPUT_PATH = Path("data/raw")  # 📄 Destination des CSV
+CSV_OUTPUT_PATH = Path("data/raw")  # 📄 Destination des CSV (optionnels)
 
-CSV_OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+# ==============================================================================
+# Paramètres d'ingestion
+# ==============================================================================
+EXTRACT_SINK = os.getenv("EXTRACT_SINK", "local")   # Même variable que le script 00
+SOURCE_PREFIX = "data/raw/"                          # Préfixe MinIO des classeurs extraits
+# calamine (Rust) est nettement plus rapide qu'openpyxl ; repli si absent
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
 
 # ==============================================================================
-# Liste des fichiers à traiter
+# Liste des fichiers à traiter (la table DuckDB est '<nom du CSV>_raw')
 # ==============================================================================
 files_mapping = {
     "Fichier_erp.xlsx": "erp.csv",
@@ -41,48 +52,120 @@ files_mapping = {
 # ==============================================================================
 # Fonction utilitaire : nettoyage simple des DataFrames
 # ==============================================================================
-def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+def clean_dataframe(df: pd.DataFrame, name: str) -> pd.DataFrame:
     df = df.dropna(how="all", axis=0)  # Supprime les lignes complètement vides
-    df = df.dropna(how="all", axis=1)  # Supprime les colonnes complètement vides
-    return df
+    # Supprime les colonnes complètement vides, sauf celles déclarées dans le schéma
+    empty = [col for col in df.columns if col not in SCHEMAS[name] and df[col].isna().all()]
+    return df.drop(columns=empty)
 
-# ==============================================================================
-# Début du traitement
-# ==============================================================================
-logger.info("🔄 Début de la conversion des fichiers Excel en CSV...")
 
-for excel_file, csv_file in files_mapping.items():
-    excel_path = EXTRACTED_PATH / excel_file
-    csv_path = CSV_OUTPUT_PATH / csv_file
-
-    if not excel_path.exists():
-        logger.error(f"❌ Fichier Excel introuvable : {excel_file}")
-        sys.exit(1)
+def to_text(value):
+    # 10000.0 (colonne numérique avec des vides) ➔ '10000', comme dans le fichier source
+    if pd.isna(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
 
-    try:
-        # Chargement
-        df = pd.read_excel(excel_path)
-
-        # Nettoyage
-        df = clean_dataframe(df)
+# ==============================================================================
+# Fonction utilitaire : lecture d'un classeur en table Arrow (exécutée en worker)
+# ==============================================================================
+def load_workbook(excel_path: Path, name: str) -> pa.Table:
+    df = clean_dataframe(pd.read_excel(excel_path, engine=EXCEL_ENGINE), name)
+    check_columns(name, list(df.columns))
 
-        # Sauvegarde en CSV
-        df.to_csv(csv_path, index=False)
+    # Colonnes texte du schéma et colonnes mixtes (ex. sku numériques et textuels)
+    for col in df.columns:
+        if SCHEMAS[name][col] == "VARCHAR" or df[col].dtype == object:
+            df[col] = df[col].map(to_text).astype(object)
 
-        # Vérifications
-        if not csv_path.exists():
-            raise FileNotFoundError(f"Fichier CSV non généré : {csv_file}")
-        if df.empty:
-            raise ValueError(f"DataFrame vide après conversion : {csv_file}")
+    return pa.Table.from_pandas(df, preserve_index=False)
 
-        logger.success(f"✅ {excel_file} ➔ {csv_file} ({len(df)} lignes)")
+# ==============================================================================
+# Point d'entrée de l'étape
+# ==============================================================================
+def main(con=None, s3_client=None) -> None:
+    setup_logger("conversion_excel_csv.log")
+    CSV_OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+    EXTRACTED_PATH.mkdir(parents=True, exist_ok=True)
+
+    # ==========================================================================
+    # Début du traitement
+    # ==========================================================================
+    logger.info(f"🔄 Début de l'ingestion des fichiers Excel dans DuckDB (moteur {EXCEL_ENGINE})...")
+
+    # Classeurs extraits directement dans MinIO par le script 00
+    download = None
+    if EXTRACT_SINK == "minio":
+        try:
+            download = download_files(
+                [(f"{SOURCE_PREFIX}{excel_file}", EXTRACTED_PATH / excel_file) for excel_file in files_mapping],
+                s3_client,
+            )
+            logger.info(f"📥 Classeurs téléchargés depuis MinIO ({SOURCE_PREFIX})")
+        except TransferError as e:
+            logger.error(f"❌ Classeurs introuvables dans MinIO : {e}")
+            sys.exit(1)
+
+    for excel_file in files_mapping:
+        if not (EXTRACTED_PATH / excel_file).exists():
+            logger.error(f"❌ Fichier Excel introuvable : {excel_file}")
+            sys.exit(1)
 
+    try:
+        con = connect_duckdb(con)
     except Exception as e:
-        logger.error(f"❌ Erreur lors du traitement de {excel_file} : {e}")
+        logger.error(f"❌ Connexion à DuckDB échouée : {e}")
         sys.exit(1)
 
-# ==============================================================================
-# Fin du script
-# ==============================================================================
-logger.success("🎯 Tous les fichiers Excel ont été convertis et nettoyés avec succès.")
-
+    if download is not None:
+        record_transfer(con, "01_excel_to_csv", download)
+
+    # Lecture des trois classeurs en parallèle (un processus par fichier)
+    with ProcessPoolExecutor(max_workers=len(files_mapping)) as executor:
+        futures = {
+            excel_file: executor.submit(load_workbook, EXTRACTED_PATH / excel_file, Path(csv_file).stem)
+            for excel_file, csv_file in files_mapping.items()
+        }
+
+        for excel_file, csv_file in files_mapping.items():
+            name = Path(csv_file).stem
+            table_name = f"{name}_raw"
+            csv_path = CSV_OUTPUT_PATH / csv_file
+
+            try:
+                # Chargement
+                arrow_table = futures[excel_file].result()
+
+                # Vérifications
+                if arrow_table.num_rows == 0:
+                    raise ValueError(f"Table vide après conversion : {excel_file}")
+
+                # Enregistrement direct dans DuckDB, typé selon le schéma déclaré
+                con.register("arrow_source", arrow_table)
+                con.execute(f"CREATE OR REPLACE TABLE {table_name} AS {cast_projection(name, 'arrow_source')}")
+                con.unregister("arrow_source")
+                check_relation(con, name, table_name)
+
+                # Export CSV optionnel
+                if EXPORT_RAW_CSV:
+                    con.execute(f"COPY {table_name} TO '{csv_path}' (HEADER, DELIMITER ',')")
+                    if not csv_path.exists():
+                        raise FileNotFoundError(f"Fichier CSV non généré : {csv_file}")
+
+                record_metrics(con, "01_excel_to_csv", {f"{name}_brut": arrow_table.num_rows})
+                record_metrics(con, "01_excel_to_csv", {f"{name}_xlsx": (EXTRACTED_PATH / excel_file).stat().st_size}, "octets")
+                logger.success(f"✅ {excel_file} ➔ {table_name} ({arrow_table.num_rows} lignes)")
+
+            except Exception as e:
+                logger.error(f"❌ Erreur lors du traitement de {excel_file} : {e}")
+                sys.exit(1)
+
+    # ==========================================================================
+    # Fin de l'étape
+    # ==========================================================================
+    logger.success("🎯 Tous les fichiers Excel ont été ingérés et nettoyés avec succès.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,150 +1,189 @@
 # === Script 05 - Nettoyage complet et préparation des fichiers pour la suite du pipeline ===
-# Ce script analyse les fichiers CSV bruts depuis MinIO,
+# Ce script analyse les données brutes (tables *_raw ingérées par le script 01,
+# ou à défaut les fichiers CSV bruts),
 # applique un nettoyage enrichi (suppression lignes/colonnes vides, exclusions métiers spécifiques),
 # génère un résumé statistique, stocke les résultats nettoyés dans 'data/outputs/',
 # et crée une base DuckDB pour les traitements suivants.
+# Chaque source est chargée une seule fois dans DuckDB : les comptages
+# (lignes initiales, vides, conservées) sont calculés par agrégats SQL
+# dans un même parcours, sans DataFrame pandas intermédiaire.
+# Les couches *_clean sont des vues par défaut (voir MATERIALIZATION dans common.py).
 
-import duckdb
 import pandas as pd
 from pathlib import Path
 from loguru import logger
 import sys
 import warnings
+from common import setup_logger, connect_duckdb, materialize, relation_exists, MATERIALIZATION, EXPORT_RAW_CSV, RAW_ARCHIVE_SUFFIX
+from storage import DIRECT_READ, configure_duckdb_s3, s3_uri
+from schemas import check_relation, read_csv_typed, read_parquet_typed, SCHEMAS, WEB_TEXT_COLUMNS
+from metrics import record_metrics
 
 warnings.filterwarnings("ignore")
 
-# ----------------------------------------------------------------------
-# Configuration des logs
-# ----------------------------------------------------------------------
-logger.remove()
-logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
-logger.add(sys.stderr, level="WARNING")
-
-LOGS_PATH = Path("logs")
-LOGS_PATH.mkdir(parents=True, exist_ok=True)
-logger.add(LOGS_PATH / "clean_data.log", level="INFO", rotation="500 KB")
-
 # ----------------------------------------------------------------------
 # Chemins
 # ----------------------------------------------------------------------
 RAW_PATH = Path("data/raw")
 OUTPUTS_PATH = Path("data/outputs")
 
-RAW_PATH.mkdir(parents=True, exist_ok=True)
-OUTPUTS_PATH.mkdir(parents=True, exist_ok=True)
-
-# ----------------------------------------------------------------------
-# Fichiers attendus
-# ----------------------------------------------------------------------
-erp_csv = RAW_PATH / "erp.csv"
-web_csv = RAW_PATH / "web.csv"
-liaison_csv = RAW_PATH / "liaison.csv"
-
-# ----------------------------------------------------------------------
-# Chargement et analyse initiale
-# ----------------------------------------------------------------------
-logger.info("📊 Lecture et analyse initiale des fichiers CSV...")
-
-try:
-    df_erp = pd.read_csv(erp_csv)
-    df_web = pd.read_csv(web_csv)
-    df_liaison = pd.read_csv(liaison_csv)
-
-    logger.info(f"ERP     : {len(df_erp)} lignes")
-    logger.info(f"WEB     : {len(df_web)} lignes")
-    logger.info(f"LIAISON : {len(df_liaison)} lignes")
-
-    logger.info(f"ERP - lignes vides : {df_erp.isnull().all(axis=1).sum()}")
-    logger.info(f"WEB - lignes vides : {df_web.isnull().all(axis=1).sum()}")
-    logger.info(f"LIAISON - lignes vides : {df_liaison.isnull().all(axis=1).sum()}")
-
-except Exception as e:
-    logger.error(f"❌ Erreur lors du chargement initial : {e}")
-    exit(1)
-
-# ----------------------------------------------------------------------
-# Connexion DuckDB
-# ----------------------------------------------------------------------
-try:
-    Path("data").mkdir(exist_ok=True)
-    con = duckdb.connect("data/bottleneck.duckdb")
-    logger.info("🦆 Connexion à DuckDB établie.")
-except Exception as e:
-    logger.error(f"❌ Connexion à DuckDB échouée : {e}")
-    exit(1)
-
-# ----------------------------------------------------------------------
-# Nettoyage métier
-# ----------------------------------------------------------------------
-try:
-    # Nettoyage ERP
-    con.execute("""
-        CREATE OR REPLACE TABLE erp_clean AS
-        SELECT * FROM read_csv_auto('data/raw/erp.csv')
-        WHERE product_id IS NOT NULL
-          AND onsale_web IS NOT NULL
-          AND price IS NOT NULL AND price > 0
-          AND stock_quantity IS NOT NULL
-          AND stock_status IS NOT NULL
-    """)
-    logger.success("✅ Table 'erp_clean' créée.")
-
-    # Nettoyage WEB
-    con.execute("""
-        CREATE OR REPLACE TABLE web_clean AS
-        SELECT * FROM read_csv_auto('data/raw/web.csv')
-        WHERE sku IS NOT NULL
-    """)
-    logger.success("✅ Table 'web_clean' créée.")
-
-    # Nettoyage LIAISON
-    con.execute("""
-        CREATE OR REPLACE TABLE liaison_clean AS
-        SELECT * FROM read_csv_auto('data/raw/liaison.csv')
-        WHERE product_id IS NOT NULL
-          AND id_web IS NOT NULL
-    """)
-    logger.success("✅ Table 'liaison_clean' créée.")
-
-except Exception as e:
-    logger.error(f"❌ Erreur lors du nettoyage avec DuckDB : {e}")
-    exit(1)
-
-# ----------------------------------------------------------------------
-# Export des fichiers nettoyés
-# ----------------------------------------------------------------------
-try:
-    con.execute("COPY erp_clean TO 'data/outputs/erp_clean.csv' (HEADER, DELIMITER ',')")
-    con.execute("COPY web_clean TO 'data/outputs/web_clean.csv' (HEADER, DELIMITER ',')")
-    con.execute("COPY liaison_clean TO 'data/outputs/liaison_clean.csv' (HEADER, DELIMITER ',')")
-
-    logger.success("📁 Fichiers nettoyés exportés dans 'data/outputs/'.")
-
-except Exception as e:
-    logger.error(f"❌ Erreur lors de l'export des fichiers nettoyés : {e}")
-    exit(1)
-
-# ----------------------------------------------------------------------
-# Résumé statistique
 # ----------------------------------------------------------------------
-try:
-    resume_df = pd.DataFrame({
-        "source": ["erp", "web", "liaison"],
-        "nb_lignes_initiales": [len(df_erp), len(df_web), len(df_liaison)],
-        "nb_apres_nettoyage": [
-            con.execute("SELECT COUNT(*) FROM erp_clean").fetchone()[0],
-            con.execute("SELECT COUNT(*) FROM web_clean").fetchone()[0],
-            con.execute("SELECT COUNT(*) FROM liaison_clean").fetchone()[0],
-        ]
-    })
-
-    resume_df["nb_exclues"] = resume_df["nb_lignes_initiales"] - resume_df["nb_apres_nettoyage"]
-    resume_df.to_csv(OUTPUTS_PATH / "resume_stats.csv", index=False)
-
-    logger.success("📈 Résumé statistique exporté : 'resume_stats.csv'.")
-
-except Exception as e:
-    logger.error(f"❌ Erreur lors de la génération du résumé : {e}")
-    exit(1)
-
-logger.success("🎯 Nettoyage complet terminé avec succès.")
+# Sources attendues
+# ----------------------------------------------------------------------
+SOURCES = ["erp", "web", "liaison"]
+
+# Règles métier : une ligne est conservée si elle satisfait le filtre
+CLEAN_FILTERS = {
+    "erp": """
+        product_id IS NOT NULL
+        AND onsale_web IS NOT NULL
+        AND price IS NOT NULL AND price > 0
+        AND stock_quantity IS NOT NULL
+        AND stock_status IS NOT NULL
+    """,
+    "web": "sku IS NOT NULL",
+    "liaison": "product_id IS NOT NULL AND id_web IS NOT NULL",
+}
+
+
+def raw_source(con, name: str) -> str:
+    # Table '<name>_raw' ingérée par le script 01, sinon repli sur le fichier brut archivé
+    # (CSV, ou Parquet avec EXPORT_RAW_CSV=0 ; lu directement dans MinIO si
+    # MINIO_DIRECT_READ=1), typé selon le schéma déclaré
+    if relation_exists(con, f"{name}_raw"):
+        check_relation(con, name, f"{name}_raw")
+        return f"{name}_raw"
+    path = s3_uri(f"data/raw/{name}{RAW_ARCHIVE_SUFFIX}") if DIRECT_READ else f"{RAW_PATH / name}{RAW_ARCHIVE_SUFFIX}"
+    if EXPORT_RAW_CSV:
+        return read_csv_typed(con, name, path)
+    return read_parquet_typed(con, name, path)
+
+
+def load_source(con, name: str) -> str:
+    # Un CSV n'est parsé qu'une fois : on le matérialise en table '<name>_raw',
+    # base des vues nettoyées
+    source = raw_source(con, name)
+    if source != f"{name}_raw":
+        con.execute(f"CREATE OR REPLACE TABLE {name}_raw AS SELECT * FROM {source}")
+    return f"{name}_raw"
+
+
+def profile_source(con, name: str, source: str) -> dict:
+    # Lignes initiales, vides et conservées en un seul agrégat
+    columns = [col[0] for col in con.execute(f"SELECT * FROM {source} LIMIT 0").description]
+    all_null = " AND ".join(f'"{col}" IS NULL' for col in columns)
+    initial, empty, kept = con.execute(f"""
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE {all_null}),
+            COUNT(*) FILTER (WHERE {CLEAN_FILTERS[name]})
+        FROM {source}
+    """).fetchone()
+    return {"initial": initial, "empty": empty, "kept": kept}
+
+# ----------------------------------------------------------------------
+# Point d'entrée de l'étape
+# ----------------------------------------------------------------------
+def main(con=None) -> None:
+    setup_logger("clean_data.log")
+    RAW_PATH.mkdir(parents=True, exist_ok=True)
+    OUTPUTS_PATH.mkdir(parents=True, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Connexion DuckDB
+    # ------------------------------------------------------------------
+    try:
+        con = connect_duckdb(con)
+        logger.info("🦆 Connexion à DuckDB établie.")
+        if DIRECT_READ:
+            configure_duckdb_s3(con)
+    except Exception as e:
+        logger.error(f"❌ Connexion à DuckDB échouée : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Chargement et analyse initiale
+    # ------------------------------------------------------------------
+    logger.info("📊 Lecture et analyse initiale des sources brutes...")
+
+    try:
+        sources = {name: load_source(con, name) for name in SOURCES}
+        stats = {name: profile_source(con, name, source) for name, source in sources.items()}
+
+        for name in SOURCES:
+            logger.info(f"{name.upper():<7} : {stats[name]['initial']} lignes")
+        for name in SOURCES:
+            logger.info(f"{name.upper()} - lignes vides : {stats[name]['empty']}")
+
+        record_metrics(con, "05_clean_data", {
+            f"{name}_{key}": stats[name][key] for name in SOURCES for key in ("initial", "empty", "kept")
+        })
+
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du chargement initial : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Nettoyage métier
+    # ------------------------------------------------------------------
+    try:
+        # Vues par défaut : le filtre est composé dans le plan des étapes suivantes.
+        # Seules les colonnes déclarées pour la couche nettoyée sont projetées.
+        for name, source in sources.items():
+            columns = ", ".join(f'"{col}"' for col in SCHEMAS[f"{name}_clean"])
+            materialize(con, f"{name}_clean", f"SELECT {columns} FROM {source} WHERE {CLEAN_FILTERS[name]}", "clean")
+            logger.success(f"✅ '{name}_clean' créée ({MATERIALIZATION['clean']}).")
+
+        # Texte lourd du catalogue web, hors du chemin dédoublonnage / fusion
+        text_columns = ", ".join(f'"{col}"' for col in WEB_TEXT_COLUMNS)
+        materialize(con, "web_text", f"SELECT {text_columns} FROM {sources['web']} WHERE {CLEAN_FILTERS['web']}", "clean")
+        logger.success(f"✅ Table annexe 'web_text' créée ({MATERIALIZATION['clean']}).")
+
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du nettoyage avec DuckDB : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Export des fichiers nettoyés
+    # ------------------------------------------------------------------
+    try:
+        con.execute("COPY erp_clean TO 'data/outputs/erp_clean.csv' (HEADER, DELIMITER ',')")
+        con.execute("COPY web_clean TO 'data/outputs/web_clean.csv' (HEADER, DELIMITER ',')")
+        con.execute("COPY liaison_clean TO 'data/outputs/liaison_clean.csv' (HEADER, DELIMITER ',')")
+
+        # Copies Parquet : lues en place dans MinIO par le dédoublonnage, utiles
+        # seulement avec MINIO_DIRECT_READ=1
+        if DIRECT_READ:
+            for name in SOURCES:
+                con.execute(f"COPY {name}_clean TO 'data/outputs/{name}_clean.parquet' (FORMAT PARQUET)")
+
+        logger.success("📁 Fichiers nettoyés exportés dans 'data/outputs/'.")
+
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'export des fichiers nettoyés : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Résumé statistique
+    # ------------------------------------------------------------------
+    try:
+        resume_df = pd.DataFrame({
+            "source": SOURCES,
+            "nb_lignes_initiales": [stats[name]["initial"] for name in SOURCES],
+            "nb_apres_nettoyage": [stats[name]["kept"] for name in SOURCES],
+        })
+
+        resume_df["nb_exclues"] = resume_df["nb_lignes_initiales"] - resume_df["nb_apres_nettoyage"]
+        resume_df.to_csv(OUTPUTS_PATH / "resume_stats.csv", index=False)
+
+        logger.success("📈 Résumé statistique exporté : 'resume_stats.csv'.")
+
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la génération du résumé : {e}")
+        exit(1)
+
+    logger.success("🎯 Nettoyage complet terminé avec succès.")
+
+
+if __name__ == "__main__":
+    main()
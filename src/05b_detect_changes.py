@@ -0,0 +1,163 @@
+# === Script 05b - Détection des changements depuis l'exécution précédente ===
+# Ce script calcule une empreinte (hash MD5 du contenu) par clé métier des tables
+# nettoyées : product_id pour erp et liaison, sku pour web. Il la compare à celle
+# de l'exécution précédente et produit les tables erp_delta, web_delta et liaison_delta
+# (clé + type de changement : insert, update, delete), ainsi qu'un résumé
+# (delta_summary) portant l'empreinte globale des runs précédent et courant,
+# utilisée par le dédoublonnage incrémental (script 08) et par le snapshot (script 10).
+# Les empreintes sont conservées dans DuckDB et archivées dans MinIO
+# ('data/state/*_hash.parquet') pour être retrouvées au prochain run mensuel.
+
+from pathlib import Path
+from loguru import logger
+import sys
+import warnings
+from common import setup_logger, connect_duckdb, relation_exists, RUN_ID
+from storage import get_s3_client
+from state import restore_tables, archive_tables
+
+warnings.filterwarnings("ignore")
+
+# ----------------------------------------------------------------------
+# Paramètres
+# ----------------------------------------------------------------------
+OUTPUTS_PATH = Path("data/outputs")
+
+# Clé métier de chaque source (plusieurs lignes peuvent partager une clé)
+KEYS = {"erp": "product_id", "web": "sku", "liaison": "product_id"}
+
+
+def load_previous_hashes(con, s3_client) -> list[str]:
+    # Empreintes du run précédent : table locale, sinon archive MinIO.
+    # Renvoie les sources sans historique (premier run).
+    restore_tables(con, [f"{name}_hash" for name in KEYS], s3_client)
+    return [name for name in KEYS if not relation_exists(con, f"{name}_hash")]
+
+
+def hash_fingerprint(con, table_name: str, key: str) -> str:
+    # Empreinte globale d'une table d'empreintes (identifie l'état d'un run)
+    return con.execute(f"""
+        SELECT md5(COALESCE(string_agg({key} || ':' || row_hash, ',' ORDER BY {key}), ''))
+        FROM {table_name}
+    """).fetchone()[0]
+
+
+def compute_delta(con, name: str, first_run: bool) -> tuple[str, str]:
+    # Renvoie les empreintes globales (run précédent, run courant)
+    key = KEYS[name]
+
+    # Empreinte par clé : MD5 de chaque ligne, puis agrégat ordonné des lignes de la clé
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE {name}_hash_new AS
+        SELECT {key}, md5(string_agg(row_hash, ',' ORDER BY row_hash)) AS row_hash
+        FROM (SELECT {key}, md5(to_json(t)) AS row_hash FROM {name}_clean t)
+        GROUP BY {key}
+    """)
+
+    if first_run:
+        con.execute(f"CREATE TABLE {name}_hash AS SELECT * FROM {name}_hash_new LIMIT 0")
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {name}_delta AS
+        SELECT
+            COALESCE(n.{key}, p.{key}) AS {key},
+            CASE
+                WHEN p.{key} IS NULL THEN 'insert'
+                WHEN n.{key} IS NULL THEN 'delete'
+                ELSE 'update'
+            END AS change_type
+        FROM {name}_hash_new n
+        FULL OUTER JOIN {name}_hash p ON n.{key} = p.{key}
+        WHERE n.row_hash IS DISTINCT FROM p.row_hash
+    """)
+
+    fingerprints = (hash_fingerprint(con, f"{name}_hash", key), hash_fingerprint(con, f"{name}_hash_new", key))
+
+    # Les empreintes courantes deviennent la référence du prochain run
+    con.execute(f"CREATE OR REPLACE TABLE {name}_hash AS SELECT * FROM {name}_hash_new")
+    con.execute(f"DROP TABLE {name}_hash_new")
+    return fingerprints
+
+# ----------------------------------------------------------------------
+# Point d'entrée de l'étape
+# ----------------------------------------------------------------------
+def main(con=None, s3_client=None) -> None:
+    setup_logger("detect_changes.log")
+    OUTPUTS_PATH.mkdir(parents=True, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Connexions DuckDB et MinIO
+    # ------------------------------------------------------------------
+    try:
+        con = connect_duckdb(con)
+        if s3_client is None:
+            s3_client = get_s3_client()
+        logger.info("🦆 Connexion à DuckDB établie.")
+    except Exception as e:
+        logger.error(f"❌ Connexion échouée : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Empreintes du run précédent
+    # ------------------------------------------------------------------
+    try:
+        first_run = load_previous_hashes(con, s3_client)
+        for name in first_run:
+            logger.warning(f"⚠️ Aucune empreinte précédente pour '{name}' : toutes les clés sont considérées comme insérées.")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du chargement des empreintes précédentes : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Calcul des deltas
+    # ------------------------------------------------------------------
+    try:
+        fingerprints = {}
+        for name in KEYS:
+            fingerprints[name] = compute_delta(con, name, name in first_run)
+            logger.success(f"✅ Table '{name}_delta' créée.")
+
+        con.execute("CREATE OR REPLACE TABLE delta_summary AS " + " UNION ALL ".join(
+            f"""
+            SELECT
+                '{name}' AS source,
+                (SELECT COUNT(*) FROM {name}_hash) AS nb_cles,
+                COUNT(*) FILTER (WHERE change_type = 'insert') AS nb_insert,
+                COUNT(*) FILTER (WHERE change_type = 'update') AS nb_update,
+                COUNT(*) FILTER (WHERE change_type = 'delete') AS nb_delete,
+                '{fingerprints[name][0]}' AS empreinte_precedente,
+                '{fingerprints[name][1]}' AS empreinte_courante,
+                '{RUN_ID}' AS run_id
+            FROM {name}_delta
+            """
+            for name in KEYS
+        ))
+        con.execute(f"COPY delta_summary TO '{OUTPUTS_PATH}/delta_summary.csv' (HEADER, DELIMITER ',')")
+
+        for source, nb_cles, nb_insert, nb_update, nb_delete in con.execute(
+            "SELECT source, nb_cles, nb_insert, nb_update, nb_delete FROM delta_summary"
+        ).fetchall():
+            logger.info(
+                f"🔁 {source.upper():<7} : {nb_insert} insérée(s), {nb_update} modifiée(s), "
+                f"{nb_delete} supprimée(s) sur {nb_cles} clé(s)"
+            )
+        logger.success("📈 Résumé des changements exporté : 'delta_summary.csv'.")
+
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la détection des changements : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Archivage des empreintes pour le prochain run
+    # ------------------------------------------------------------------
+    try:
+        archive_tables(con, [f"{name}_hash" for name in KEYS], s3_client)
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'archivage des empreintes : {e}")
+        exit(1)
+
+    logger.success("🎯 Détection des changements terminée avec succès.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,110 +1,248 @@
 # === Script 08 - Dédoublonnage des fichiers nettoyés avec DuckDB ===
 # Ce script dédoublonne les tables nettoyées en supprimant les doublons
 # selon des règles spécifiques, et vérifie que les résultats sont corrects.
+# Les tables erp_clean, web_clean et liaison_clean créées par le script 05 dans
+# la même base sont lues directement. Si elles sont absentes (base indisponible),
+# les fichiers nettoyés sont réimportés en repli : Parquet lu dans MinIO avec
+# MINIO_DIRECT_READ=1, sinon CSV locaux téléchargés par le script 07.
+# Les couches *_dedup sont des vues par défaut (voir MATERIALIZATION dans common.py).
+# Avec DEDUP_MODE=incremental, ce sont des tables à clé primaire (product_id, sku)
+# où seules les clés des tables *_delta (script 05b) sont recalculées puis
+# fusionnées par INSERT OR REPLACE, avec les mêmes règles de sélection. Ces tables et
+# 'dedup_state' sont archivées dans MinIO (data/state/, module state) et restaurées
+# quand la base locale est vide (exécution Kestra).
 
-import duckdb
-from pathlib import Path
+import os
 from loguru import logger
-import sys
 import warnings
+from common import setup_logger, connect_duckdb, materialize, drop_relation, relation_exists, MATERIALIZATION
+from storage import DIRECT_READ, configure_duckdb_s3, s3_uri, get_s3_client
+from state import restore_tables, archive_tables
+from schemas import check_relation, read_csv_typed, read_parquet_typed
+from metrics import record_metrics
 
 warnings.filterwarnings("ignore")
 
 # ----------------------------------------------------------------------
-# Configuration du logger
+# Sources des tables nettoyées
 # ----------------------------------------------------------------------
-logger.remove()
-logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
-logger.add(sys.stderr, level="WARNING")
+OUTPUTS_PREFIX = "data/outputs/"
 
-LOGS_PATH = Path("logs")
-LOGS_PATH.mkdir(parents=True, exist_ok=True)
-logger.add(LOGS_PATH / "dedoublonnage.log", level="INFO", rotation="500 KB")
 
-# ----------------------------------------------------------------------
-# Connexion à DuckDB
-# ----------------------------------------------------------------------
-try:
-    Path("data").mkdir(exist_ok=True)
-    con = duckdb.connect("data/bottleneck.duckdb")
-    logger.success("✅ Connexion à DuckDB établie dans 'data/bottleneck.duckdb'.")
-except Exception as e:
-    logger.error(f"❌ Échec de connexion à DuckDB : {e}")
-    exit(1)
+DEDUP_MODE = os.getenv("DEDUP_MODE", "full")  # full | incremental
 
-# ----------------------------------------------------------------------
-# Dédoublonnage ERP (agrégation)
-# ----------------------------------------------------------------------
-try:
-    con.execute("""
-        CREATE OR REPLACE TABLE erp_dedup AS
-        SELECT 
-            product_id,
-            MAX(onsale_web)     AS onsale_web,
-            MAX(price)          AS price,
-            MAX(stock_quantity) AS stock_quantity,
-            MAX(stock_status)   AS stock_status
-        FROM read_csv_auto('data/outputs/erp_clean.csv')
-        GROUP BY product_id
-    """)
-    logger.success("✅ Table erp_dedup créée avec agrégation sur product_id.")
-except Exception as e:
-    logger.error(f"❌ Erreur lors du dédoublonnage ERP : {e}")
-    exit(1)
 
-# ----------------------------------------------------------------------
-# Dédoublonnage Liaison (agrégation)
-# ----------------------------------------------------------------------
-try:
-    con.execute("""
-        CREATE OR REPLACE TABLE liaison_dedup AS
-        SELECT 
-            product_id,
-            MIN(id_web) AS id_web
-        FROM read_csv_auto('data/outputs/liaison_clean.csv')
-        GROUP BY product_id
-    """)
-    logger.success("✅ Table liaison_dedup créée avec agrégation sur product_id.")
-except Exception as e:
-    logger.error(f"❌ Erreur lors du dédoublonnage Liaison : {e}")
-    exit(1)
+def clean_source(con, name: str) -> str:
+    # Table nettoyée de la base par défaut ; lectures typées des fichiers en repli
+    if relation_exists(con, f"{name}_clean"):
+        check_relation(con, f"{name}_clean", f"{name}_clean")
+        return f"{name}_clean"
+
+    # Réimport unique en table : les vues de dédoublonnage ne dépendent pas des fichiers
+    logger.warning(f"⚠️ Table '{name}_clean' absente : réimport du fichier nettoyé.")
+    if DIRECT_READ:
+        source = read_parquet_typed(con, f"{name}_clean", s3_uri(f"{OUTPUTS_PREFIX}{name}_clean.parquet"))
+    else:
+        source = read_csv_typed(con, f"{name}_clean", f"{OUTPUTS_PREFIX}{name}_clean.csv")
+    con.execute(f"CREATE OR REPLACE TABLE {name}_clean AS SELECT * FROM {source}")
+    return f"{name}_clean"
 
 # ----------------------------------------------------------------------
-# Dédoublonnage Web (row_number + filtre produit)
+# Règles de dédoublonnage (une ligne gagnante par clé)
 # ----------------------------------------------------------------------
-try:
-    con.execute("""
-        CREATE OR REPLACE TABLE web_dedup AS
+KEYS = {"erp": "product_id", "liaison": "product_id", "web": "sku"}
+STATE_TABLES = [f"{name}_dedup" for name in KEYS] + ["dedup_state"]
+
+
+def dedup_query(name: str, source: str, where: str = "TRUE") -> str:
+    # 'where' restreint le calcul à certaines clés (mode incrémental)
+    if name == "erp":
+        return f"""
+            SELECT 
+                product_id,
+                MAX(onsale_web)     AS onsale_web,
+                MAX(price)          AS price,
+                MAX(stock_quantity) AS stock_quantity,
+                MAX(stock_status)   AS stock_status
+            FROM {source}
+            WHERE {where}
+            GROUP BY product_id
+        """
+    if name == "liaison":
+        return f"""
+            SELECT 
+                product_id,
+                MIN(id_web) AS id_web
+            FROM {source}
+            WHERE {where}
+            GROUP BY product_id
+        """
+    return f"""
         SELECT * FROM (
             SELECT *, ROW_NUMBER() OVER (
                 PARTITION BY sku
                 ORDER BY post_date DESC
             ) AS rn
-            FROM read_csv_auto('data/outputs/web_clean.csv')
-            WHERE post_type = 'product'
+            FROM {source}
+            WHERE post_type = 'product' AND {where}
         )
         WHERE rn = 1
-    """)
-    logger.success("✅ Table web_dedup créée avec filtrage post_type = 'product' et row_number.")
-except Exception as e:
-    logger.error(f"❌ Erreur lors du dédoublonnage Web : {e}")
-    exit(1)
+    """
+
+# ----------------------------------------------------------------------
+# Mode incrémental : tables à clé primaire mises à jour par upsert
+# ----------------------------------------------------------------------
+def has_primary_key(con, table_name: str) -> bool:
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_constraints() WHERE table_name = ? AND constraint_type = 'PRIMARY KEY'",
+        [table_name],
+    ).fetchone()[0] > 0
+
+
+def delta_fingerprints(con, name: str) -> tuple[str, str] | None:
+    # Empreintes (run précédent, run courant) produites par le script 05b
+    if not relation_exists(con, "delta_summary") or not relation_exists(con, f"{name}_delta"):
+        return None
+    return con.execute(
+        "SELECT empreinte_precedente, empreinte_courante FROM delta_summary WHERE source = ?", [name]
+    ).fetchone()
+
+
+def build_dedup(con, name: str) -> str:
+    # Renvoie le mode utilisé, pour les logs
+    source = clean_source(con, name)
+    if DEDUP_MODE != "incremental":
+        materialize(con, f"{name}_dedup", dedup_query(name, source), "dedup")
+        return MATERIALIZATION["dedup"]
+
+    key = KEYS[name]
+    table_name = f"{name}_dedup"
+    state = con.execute("SELECT empreinte FROM dedup_state WHERE source = ?", [name]).fetchone()
+    fingerprints = delta_fingerprints(con, name)
+
+    if has_primary_key(con, table_name) and fingerprints and state and state[0] == fingerprints[0]:
+        # Seules les clés modifiées depuis le dernier run sont recalculées
+        changed = f"{key} IN (SELECT {key} FROM {name}_delta)"
+        winners = dedup_query(name, source, changed)
+        con.execute(f"""
+            DELETE FROM {table_name}
+            WHERE {changed} AND {key} NOT IN (SELECT {key} FROM ({winners}))
+        """)
+        con.execute(f"INSERT OR REPLACE INTO {table_name} {winners}")
+        mode = "incrémental"
+    else:
+        # Table absente, sans clé ou désynchronisée des deltas : reconstruction complète
+        logger.warning(f"⚠️ {table_name} : reconstruction complète avant le prochain run incrémental.")
+        query = dedup_query(name, source)
+        columns = ", ".join(f'"{col}" {col_type}' for col, col_type, *_ in con.execute(f"DESCRIBE {query}").fetchall())
+        drop_relation(con, table_name)
+        con.execute(f"CREATE TABLE {table_name} ({columns}, PRIMARY KEY ({key}))")
+        con.execute(f"INSERT INTO {table_name} {query}")
+        mode = "incrémental, reconstruction"
+
+    con.execute(
+        "INSERT OR REPLACE INTO dedup_state VALUES (?, ?)", [name, fingerprints[1] if fingerprints else None]
+    )
+    return mode
 
 # ----------------------------------------------------------------------
-# Validation du dédoublonnage
+# Point d'entrée de l'étape
 # ----------------------------------------------------------------------
-try:
-    nb_erp = con.execute("SELECT COUNT(*) FROM erp_dedup").fetchone()[0]
-    nb_web = con.execute("SELECT COUNT(*) FROM web_dedup").fetchone()[0]
-    nb_liaison = con.execute("SELECT COUNT(*) FROM liaison_dedup").fetchone()[0]
+def main(con=None, s3_client=None) -> None:
+    setup_logger("dedoublonnage.log")
+
+    # ------------------------------------------------------------------
+    # Connexion à DuckDB
+    # ------------------------------------------------------------------
+    try:
+        con = connect_duckdb(con)
+        logger.success("✅ Connexion à DuckDB établie dans 'data/bottleneck.duckdb'.")
+        if DIRECT_READ:
+            configure_duckdb_s3(con)
+    except Exception as e:
+        logger.error(f"❌ Échec de connexion à DuckDB : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Mode incrémental : état du run précédent (base locale, sinon MinIO)
+    # ------------------------------------------------------------------
+    if DEDUP_MODE == "incremental":
+        try:
+            if s3_client is None:
+                s3_client = get_s3_client()
+            con.execute("CREATE TABLE IF NOT EXISTS dedup_state (source VARCHAR PRIMARY KEY, empreinte VARCHAR)")
+            restored = restore_tables(
+                con, STATE_TABLES, s3_client, {f"{name}_dedup": key for name, key in KEYS.items()}
+            )
+            if restored:
+                logger.info(f"♻️  État du dédoublonnage restauré depuis MinIO : {restored}")
+        except Exception as e:
+            logger.error(f"❌ Erreur lors de la restauration de l'état du dédoublonnage : {e}")
+            exit(1)
+
+    # ------------------------------------------------------------------
+    # Dédoublonnage ERP (agrégation)
+    # ------------------------------------------------------------------
+    try:
+        mode = build_dedup(con, "erp")
+        logger.success(f"✅ erp_dedup créée ({mode}) avec agrégation sur product_id.")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du dédoublonnage ERP : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Dédoublonnage Liaison (agrégation)
+    # ------------------------------------------------------------------
+    try:
+        mode = build_dedup(con, "liaison")
+        logger.success(f"✅ liaison_dedup créée ({mode}) avec agrégation sur product_id.")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du dédoublonnage Liaison : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Dédoublonnage Web (row_number + filtre produit)
+    # ------------------------------------------------------------------
+    try:
+        mode = build_dedup(con, "web")
+        logger.success(f"✅ web_dedup créée ({mode}) avec filtrage post_type = 'product' et row_number.")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du dédoublonnage Web : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Validation du dédoublonnage
+    # ------------------------------------------------------------------
+    try:
+        nb_erp, nb_web, nb_liaison = con.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM erp_dedup),
+                (SELECT COUNT(*) FROM web_dedup),
+                (SELECT COUNT(*) FROM liaison_dedup)
+        """).fetchone()
+        record_metrics(con, "08_dedoublonnage", {"erp_dedup": nb_erp, "web_dedup": nb_web, "liaison_dedup": nb_liaison})
+
+        assert nb_erp > 0, "❌ Table erp_dedup vide"
+        assert nb_web > 0, "❌ Table web_dedup vide"
+        assert nb_liaison > 0, "❌ Table liaison_dedup vide"
+
+        logger.info(f"✔️  Lignes dédoublonnées - ERP: {nb_erp}, Web: {nb_web}, Liaison: {nb_liaison}")
+        logger.success("🎯 Dédoublonnage terminé avec succès et validé.")
+
+    except Exception as e:
+        logger.error(f"❌ Échec dans la validation du dédoublonnage : {e}")
+        exit(1)
 
-    assert nb_erp > 0, "❌ Table erp_dedup vide"
-    assert nb_web > 0, "❌ Table web_dedup vide"
-    assert nb_liaison > 0, "❌ Table liaison_dedup vide"
+    # ------------------------------------------------------------------
+    # Mode incrémental : archivage de l'état pour le prochain run
+    # ------------------------------------------------------------------
+    if DEDUP_MODE == "incremental":
+        try:
+            archive_tables(con, STATE_TABLES, s3_client)
+        except Exception as e:
+            logger.error(f"❌ Erreur lors de l'archivage de l'état du dédoublonnage : {e}")
+            exit(1)
 
-    logger.info(f"✔️  Lignes dédoublonnées - ERP: {nb_erp}, Web: {nb_web}, Liaison: {nb_liaison}")
-    logger.success("🎯 Dédoublonnage terminé avec succès et validé.")
 
-except Exception as e:
-    logger.error(f"❌ Échec dans la validation du dédoublonnage : {e}")
-    exit(1)
+if __name__ == "__main__":
+    main()
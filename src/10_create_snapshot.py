@@ -1,35 +1,336 @@
-# === Script 10 - Snapshot de la base DuckDB après fusion ===
-# Ce script copie le fichier de base de données après fusion
-# pour créer une sauvegarde figée du travail de nettoyage, dédoublonnage et fusion.
+# === Script 10 - Snapshot incrémental de la base DuckDB après fusion ===
+# Ce script fige l'état de la base (nettoyage, dédoublonnage, fusion) sans copier
+# le fichier .duckdb : après un CHECKPOINT, chaque table est exportée en Parquet
+# (ZSTD) dans un magasin adressé par contenu, 'data/snapshots/objects/<empreinte>.parquet'.
+# Une table inchangée garde la même empreinte et son fichier est partagé entre
+# snapshots : un snapshot ne coûte que ce qui a changé. Chaque snapshot est décrit
+# par un manifeste JSON (DDL des tables, vues et index + objet de chaque table).
+# Les empreintes déjà calculées pendant le run sont réutilisées (delta_summary du
+# script 05b pour *_clean et *_hash, dedup_state du script 08 pour *_dedup) : seules
+# les autres tables sont relues en entier. Les tables de métriques (stage_metrics,
+# pipeline_runs), en ajout seul et archivées à chaque run par le runner (data/state/),
+# sont exclues : leur empreinte changerait à chaque snapshot.
+#
+# Variables d'environnement :
+#   SNAPSHOT_KEEP    nombre de snapshots conservés (défaut : 6), objets orphelins supprimés
+#   SNAPSHOT_UPLOAD  1 = envoi des nouveaux objets et du manifeste dans MinIO (défaut : 0)
+#
+# Restauration : restore_snapshot(manifeste, base_cible) recrée tables, vues et index
+# (les vues sur fichiers externes indisponibles sont ignorées avec un avertissement).
 
-import shutil
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
 from pathlib import Path
 from loguru import logger
 import sys
-
-# Configuration du logger
-logger.remove()
-logger.add(sys.stdout, level="INFO")
-logger.add(sys.stderr, level="WARNING")
-
-LOGS_PATH = Path("logs")
-LOGS_PATH.mkdir(parents=True, exist_ok=True)
-logger.add(LOGS_PATH / "snapshot_duckdb.log", level="INFO", rotation="500 KB")
+import duckdb
+from botocore.exceptions import ClientError
+from common import setup_logger, connect_duckdb, relation_exists, RUN_ID
+from storage import get_s3_client, upload_files, download_files, delete_files, BUCKET_NAME, MANIFEST_NAME
+from metrics import record_metrics, METRICS_TABLES
 
 # Chemins
 DATA_PATH = Path("data")
-SOURCE_DUCKDB = DATA_PATH / "bottleneck.duckdb"
 SNAPSHOT_DIR = DATA_PATH / "snapshots"
-SNAPSHOT_FILE = SNAPSHOT_DIR / "bottleneck_fusion_ok.duckdb"
+OBJECTS_DIR = SNAPSHOT_DIR / "objects"
+MANIFESTS_DIR = SNAPSHOT_DIR / "manifests"
+SNAPSHOT_PREFIX = "data/snapshots/"
+
+# Paramètres
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "6"))
+SNAPSHOT_UPLOAD = os.getenv("SNAPSHOT_UPLOAD", "0") == "1"
+
+
+# ----------------------------------------------------------------------
+# Empreintes et export des tables
+# ----------------------------------------------------------------------
+def list_tables(con) -> dict[str, str]:
+    # Tables persistantes de la base courante, hors métriques : {nom : CREATE TABLE ...}
+    rows = con.execute("""
+        SELECT table_name, sql FROM duckdb_tables()
+        WHERE database_name = current_database() AND schema_name = 'main'
+          AND NOT temporary AND NOT internal AND NOT list_contains(?, table_name)
+        ORDER BY table_name
+    """, [METRICS_TABLES]).fetchall()
+    return dict(rows)
+
+
+def known_fingerprints(con) -> dict[str, str]:
+    # Empreintes de contenu déjà calculées par le pipeline pendant ce run :
+    # - delta_summary (script 05b) : empreinte des tables *_hash, donc des *_clean dont
+    #   elles dérivent ; ignorée si elle date d'un autre run ;
+    # - dedup_state (script 08) : la table *_dedup est à jour de cette même empreinte.
+    if not relation_exists(con, "delta_summary"):
+        return {}
+    columns = [row[0] for row in con.execute("DESCRIBE delta_summary").fetchall()]
+    if "run_id" not in columns:
+        return {}
+    known = {}
+    for source, fingerprint in con.execute(
+        "SELECT source, empreinte_courante FROM delta_summary WHERE run_id = ?", [RUN_ID]
+    ).fetchall():
+        known[f"{source}_clean"] = known[f"{source}_hash"] = f"delta:{fingerprint}"
+    if relation_exists(con, "dedup_state"):
+        for source, fingerprint in con.execute("SELECT source, empreinte FROM dedup_state").fetchall():
+            if fingerprint is not None and known.get(f"{source}_hash") == f"delta:{fingerprint}":
+                known[f"{source}_dedup"] = f"delta:{fingerprint}"
+    return known
+
+
+def content_digest(con, relation: str) -> str:
+    # Empreinte complète indépendante de l'ordre de stockage (une seule lecture) :
+    # MD5 de chaque ligne, concaténés dans l'ordre de ces MD5 puis hachés
+    return con.execute(f"""
+        SELECT md5(COALESCE(string_agg(row_md5, '' ORDER BY row_md5), ''))
+        FROM (SELECT md5(CAST(t AS VARCHAR)) AS row_md5 FROM {relation} t)
+    """).fetchone()[0]
+
+
+def table_fingerprint(con, name: str, ddl: str, known: dict[str, str] | None = None) -> str:
+    # Empreinte réutilisée si connue, sinon relecture complète ; DDL inclus
+    digest = (known or {}).get(name) or content_digest(con, f'"{name}"')
+    return hashlib.sha256(f"{ddl}|{digest}".encode()).hexdigest()
+
+
+def object_key(fingerprint: str) -> str:
+    return f"objects/{fingerprint}.parquet"
+
+
+def remote_exists(s3_client, s3_key: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=BUCKET_NAME, Key=s3_key)
+        return True
+    except ClientError:
+        return False
+
+
+# ----------------------------------------------------------------------
+# Rétention
+# ----------------------------------------------------------------------
+def local_manifests() -> list[dict]:
+    manifests = [json.loads(path.read_text()) for path in MANIFESTS_DIR.glob("*.json")]
+    return sorted(manifests, key=lambda manifest: manifest["created_at"], reverse=True)
+
+
+def apply_retention(s3_client) -> tuple[list[str], list[str]]:
+    # Conserve les SNAPSHOT_KEEP manifestes les plus récents et supprime les objets
+    # qui ne sont plus référencés. Renvoie (snapshots supprimés, objets supprimés).
+    manifests = local_manifests()
+    kept, expired = manifests[:SNAPSHOT_KEEP], manifests[SNAPSHOT_KEEP:]
+    referenced = {table["object"] for manifest in kept for table in manifest["tables"].values()}
+
+    for manifest in expired:
+        (MANIFESTS_DIR / f"{manifest['snapshot_id']}.json").unlink()
+    orphans = [
+        path.relative_to(SNAPSHOT_DIR).as_posix()
+        for path in OBJECTS_DIR.glob("*.parquet")
+        if path.relative_to(SNAPSHOT_DIR).as_posix() not in referenced
+    ]
+    for key in orphans:
+        (SNAPSHOT_DIR / key).unlink()
+
+    if SNAPSHOT_UPLOAD:
+        orphans += apply_remote_retention(s3_client)
+    return [manifest["snapshot_id"] for manifest in expired], orphans
+
+
+def list_remote(s3_client, prefix: str, suffix: str) -> list[dict]:
+    paginator = s3_client.get_paginator("list_objects_v2")
+    return [
+        obj
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix)
+        for obj in page.get("Contents", [])
+        if obj["Key"].endswith(suffix) and not obj["Key"].endswith(MANIFEST_NAME)
+    ]
+
+
+def apply_remote_retention(s3_client) -> list[str]:
+    # Même règle côté MinIO, d'après les manifestes distants (le répertoire local
+    # d'une exécution Kestra ne contient que le snapshot courant)
+    manifests = sorted(
+        list_remote(s3_client, f"{SNAPSHOT_PREFIX}manifests/", ".json"),
+        key=lambda obj: obj["LastModified"], reverse=True,
+    )
+    kept, expired = manifests[:SNAPSHOT_KEEP], manifests[SNAPSHOT_KEEP:]
+    referenced = set()
+    for obj in kept:
+        body = s3_client.get_object(Bucket=BUCKET_NAME, Key=obj["Key"])["Body"]
+        referenced |= {table["object"] for table in json.loads(body.read())["tables"].values()}
+
+    stale = [obj["Key"] for obj in expired] + [
+        obj["Key"]
+        for obj in list_remote(s3_client, f"{SNAPSHOT_PREFIX}objects/", ".parquet")
+        if obj["Key"].removeprefix(SNAPSHOT_PREFIX) not in referenced
+    ]
+    if stale:
+        delete_files(stale, s3_client)
+    return stale
+
+
+# ----------------------------------------------------------------------
+# Restauration
+# ----------------------------------------------------------------------
+def restore_snapshot(manifest_path: Path, target_path: Path, s3_client=None) -> list[str]:
+    # Recrée une base DuckDB à partir d'un manifeste ; les objets absents en local
+    # sont téléchargés depuis MinIO. Renvoie les vues non restaurées.
+    manifest = json.loads(Path(manifest_path).read_text())
+    missing = [
+        (f"{SNAPSHOT_PREFIX}{table['object']}", SNAPSHOT_DIR / table["object"])
+        for table in manifest["tables"].values()
+        if not (SNAPSHOT_DIR / table["object"]).exists()
+    ]
+    if missing:
+        download_files(missing, s3_client)
+
+    target = duckdb.connect(str(target_path))
+    for name, table in manifest["tables"].items():
+        target.execute(table["ddl"])
+        target.execute(f"INSERT INTO \"{name}\" SELECT * FROM read_parquet('{SNAPSHOT_DIR / table['object']}')")
+
+    # Vues dépendantes les unes des autres : nouvelles passes tant que l'une d'elles échoue.
+    # Les vues sur fichiers externes (historique *_historique : glob local ou MinIO) ne
+    # sont pas dans le snapshot : fichiers absents ou MinIO injoignable, elles sont
+    # ignorées avec un avertissement, ainsi que les vues qui en dépendent.
+    pending = dict(manifest["views"])
+    skipped = []
+    while pending:
+        created = []
+        for name, sql in list(pending.items()):
+            try:
+                target.execute(sql)
+                created.append(name)
+            except duckdb.CatalogException:
+                continue
+            except duckdb.IOException as e:
+                logger.warning(f"⚠️ Vue '{name}' non restaurée (source externe indisponible) : {e}")
+                skipped.append(name)
+                del pending[name]
+        if not created:
+            if not skipped:
+                raise RuntimeError(f"Vues non restaurables : {list(pending)}")
+            logger.warning(f"⚠️ Vue(s) dépendant de vues non restaurées ignorée(s) : {list(pending)}")
+            skipped += list(pending)
+            break
+        for name in created:
+            del pending[name]
+
+    for sql in manifest["indexes"]:
+        target.execute(sql)
+    target.close()
+    return skipped
+
+
+# ----------------------------------------------------------------------
+# Point d'entrée de l'étape
+# ----------------------------------------------------------------------
+def main(con=None, s3_client=None) -> None:
+    # Configuration du logger
+    setup_logger("snapshot_duckdb.log", info_only=False)
+
+    OBJECTS_DIR.mkdir(parents=True, exist_ok=True)
+    MANIFESTS_DIR.mkdir(parents=True, exist_ok=True)
+
+    try:
+        con = connect_duckdb(con)
+        if SNAPSHOT_UPLOAD and s3_client is None:
+            s3_client = get_s3_client()
+        # WAL vidé dans le fichier avant lecture : état stable et complet
+        con.execute("CHECKPOINT")
+    except Exception as e:
+        logger.error(f"❌ Erreur de préparation du snapshot : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Export des tables modifiées (lecture cohérente dans une transaction)
+    # ------------------------------------------------------------------
+    try:
+        manifest = {
+            "snapshot_id": RUN_ID,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "tables": {},
+            "views": {},
+            "indexes": [],
+        }
+        new_objects = []
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            known = known_fingerprints(con)
+            for name, ddl in list_tables(con).items():
+                key = object_key(table_fingerprint(con, name, ddl, known))
+                path = SNAPSHOT_DIR / key
+                shared = path.exists() or (SNAPSHOT_UPLOAD and remote_exists(s3_client, f"{SNAPSHOT_PREFIX}{key}"))
+                if not shared:
+                    # Écriture puis renommage : un objet interrompu n'est jamais réutilisé
+                    partial = path.with_suffix(".part")
+                    con.execute(f"COPY \"{name}\" TO '{partial}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+                    partial.replace(path)
+                    new_objects.append(path)
+                manifest["tables"][name] = {"object": key, "ddl": ddl, "shared": shared}
+
+            manifest["views"] = dict(con.execute("""
+                SELECT view_name, sql FROM duckdb_views()
+                WHERE database_name = current_database() AND schema_name = 'main'
+                  AND NOT temporary AND NOT internal
+                ORDER BY view_name
+            """).fetchall())
+            manifest["indexes"] = [row[0] for row in con.execute("""
+                SELECT sql FROM duckdb_indexes()
+                WHERE database_name = current_database() AND schema_name = 'main' AND sql IS NOT NULL
+                  AND NOT list_contains(?, table_name)
+            """, [METRICS_TABLES]).fetchall()]
+            con.execute("COMMIT")
+        except Exception:
+            # Transaction de lecture abandonnée : la connexion partagée reste utilisable
+            con.execute("ROLLBACK")
+            raise
+
+        manifest_path = MANIFESTS_DIR / f"{RUN_ID}.json"
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+
+        new_bytes = sum(path.stat().st_size for path in new_objects)
+        record_metrics(con, "10_create_snapshot", {"tables": len(manifest["tables"]), "nouveaux_objets": len(new_objects)}, "fichiers")
+        record_metrics(con, "10_create_snapshot", {"octets_nouveaux": new_bytes}, "octets")
+        logger.success(
+            f"✅ Snapshot {RUN_ID} : {len(manifest['tables'])} table(s), "
+            f"{len(new_objects)} nouvel(s) objet(s) ({new_bytes / 1024 / 1024:.2f} Mo), "
+            f"{len(manifest['tables']) - len(new_objects)} partagé(s)"
+        )
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la création du snapshot : {e}")
+        exit(1)
+
+    # ------------------------------------------------------------------
+    # Upload MinIO (optionnel) : nouveaux objets puis manifeste
+    # ------------------------------------------------------------------
+    if SNAPSHOT_UPLOAD:
+        try:
+            upload_files(
+                [(path, f"{SNAPSHOT_PREFIX}{path.relative_to(SNAPSHOT_DIR).as_posix()}") for path in new_objects],
+                s3_client,
+            )
+            upload_files([(manifest_path, f"{SNAPSHOT_PREFIX}manifests/{manifest_path.name}")], s3_client)
+        except Exception as e:
+            logger.error(f"❌ Erreur d'upload du snapshot dans MinIO : {e}")
+            exit(1)
+
+    # ------------------------------------------------------------------
+    # Rétention
+    # ------------------------------------------------------------------
+    try:
+        expired, orphans = apply_retention(s3_client)
+        if expired:
+            logger.info(f"🧹 Snapshot(s) expiré(s) : {expired}")
+        if orphans:
+            logger.info(f"🧹 Objet(s) orphelin(s) supprimé(s) : {len(orphans)}")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'application de la rétention : {e}")
+        exit(1)
 
-# Création du dossier snapshots/ si besoin
-SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    logger.success("🎯 Sauvegarde de la base DuckDB après fusion réussie.")
 
-try:
-    shutil.copy2(SOURCE_DUCKDB, SNAPSHOT_FILE)
-    logger.success(f"✅ Snapshot créé : {SNAPSHOT_FILE}")
-except Exception as e:
-    logger.error(f"❌ Erreur lors de la création du snapshot : {e}")
-    exit(1)
 
-logger.success("🎯 Sauvegarde de la base DuckDB après fusion réussie.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# === Module commun - Utilitaires partagés par les scripts du pipeline ===
+# Ce module regroupe la configuration des logs et l'ouverture de la base DuckDB,
+# afin que chaque étape puisse être exécutée seule (python src/NN_*.py)
+# ou importée et appelée par le runner mono-processus (src/run_pipeline.py).
+
+import duckdb
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from loguru import logger
+import sys
+
+# ==============================================================================
+# Chemins partagés
+# ==============================================================================
+LOGS_PATH = Path("logs")
+DATA_PATH = Path("data")
+DUCKDB_PATH = DATA_PATH / "bottleneck.duckdb"
+
+# ==============================================================================
+# Identifiant du run (horodatage UTC, ou PIPELINE_RUN_ID fourni par Kestra)
+# ==============================================================================
+RUN_AT = datetime.now(timezone.utc).replace(microsecond=0)
+RUN_ID = os.getenv("PIPELINE_RUN_ID", RUN_AT.strftime("%Y%m%dT%H%M%SZ"))
+
+
+# ==============================================================================
+# Archive des données brutes (data/raw/ dans MinIO, scripts 01 à 05)
+# ==============================================================================
+# EXPORT_RAW_CSV=1 : CSV écrits par le script 01 ; sinon Parquet exportés des tables
+# *_raw par le script 02
+EXPORT_RAW_CSV = os.getenv("EXPORT_RAW_CSV", "1") == "1"
+RAW_ARCHIVE_SUFFIX = ".csv" if EXPORT_RAW_CSV else ".parquet"
+
+
+# ==============================================================================
+# Configuration des logs
+# ==============================================================================
+def setup_logger(log_filename: str, info_only: bool = True) -> None:
+    # Chaque étape écrit dans son propre fichier de log (uploadé par le script 14).
+    logger.remove()
+    if info_only:
+        logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
+    else:
+        logger.add(sys.stdout, level="INFO")
+    logger.add(sys.stderr, level="WARNING")
+
+    LOGS_PATH.mkdir(parents=True, exist_ok=True)
+    logger.add(LOGS_PATH / log_filename, level="INFO", rotation="500 KB")
+
+
+# ==============================================================================
+# Connexion DuckDB
+# ==============================================================================
+def connect_duckdb(con: duckdb.DuckDBPyConnection | None = None, runner: bool = False) -> duckdb.DuckDBPyConnection:
+    # Réutilise la connexion fournie par le runner, sinon ouvre la base locale.
+    if con is not None:
+        return con
+    # Une étape lancée seule ouvre sa propre connexion : une couche 'temp' créée
+    # ici disparaîtrait avant l'étape ou le test suivant qui la lit.
+    temp_layers = [layer for layer, policy in MATERIALIZATION.items() if policy == "temp"]
+    if temp_layers and not runner:
+        raise ValueError(
+            f"Politique 'temp' réservée au runner (run_pipeline.py) : {temp_layers}"
+        )
+    DATA_PATH.mkdir(parents=True, exist_ok=True)
+    return duckdb.connect(str(DUCKDB_PATH))
+
+
+# ==============================================================================
+# Politique de matérialisation des couches
+# ==============================================================================
+# view  : vue paresseuse, composée dans le plan de la couche suivante
+# temp  : table temporaire (visible uniquement par la connexion courante, donc
+#         uniquement sous le runner qui partage sa connexion avec étapes et tests)
+# table : table persistante dans bottleneck.duckdb
+MATERIALIZATION = {
+    "clean": os.getenv("MATERIALIZE_CLEAN", "view"),
+    "dedup": os.getenv("MATERIALIZE_DEDUP", "view"),
+    "fusion": os.getenv("MATERIALIZE_FUSION", "table"),
+    "kpi": os.getenv("MATERIALIZE_KPI", "table"),
+}
+CREATE_KINDS = {"view": "VIEW", "temp": "TEMP TABLE", "table": "TABLE"}
+# Couches relues seulement pendant le run : 'fusion' et 'kpi' doivent rester dans le
+# fichier (snapshot, rapport, historique)
+TEMP_LAYERS = {"clean", "dedup"}
+
+
+def relation_exists(con: duckdb.DuckDBPyConnection, name: str) -> bool:
+    # Table, vue ou table temporaire
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [name]
+    ).fetchone()[0] > 0
+
+
+def drop_relation(con: duckdb.DuckDBPyConnection, name: str) -> None:
+    # Supprime toute table, vue ou table temporaire portant ce nom
+    existing = con.execute(
+        "SELECT table_catalog, table_schema, table_type FROM information_schema.tables WHERE table_name = ?",
+        [name],
+    ).fetchall()
+    for catalog, schema, table_type in existing:
+        kind = "VIEW" if table_type == "VIEW" else "TABLE"
+        con.execute(f"DROP {kind} {catalog}.{schema}.{name}")
+
+
+def materialize(con: duckdb.DuckDBPyConnection, name: str, query: str, layer: str) -> None:
+    # Crée 'name' selon la politique de sa couche. Un objet existant d'un autre
+    # type (table ↔ vue) ne peut pas être remplacé directement : on le supprime.
+    policy = MATERIALIZATION[layer]
+    if policy not in CREATE_KINDS:
+        raise ValueError(f"Politique de matérialisation inconnue pour '{layer}' : {policy}")
+    if policy == "temp" and layer not in TEMP_LAYERS:
+        raise ValueError(f"Politique 'temp' non supportée pour la couche '{layer}' (couches admises : {sorted(TEMP_LAYERS)})")
+
+    drop_relation(con, name)
+    con.execute(f"CREATE {CREATE_KINDS[policy]} {name} AS {query}")
@@ -0,0 +1,108 @@
+# === Module exports - Exports directs depuis DuckDB ===
+# Les résultats sont écrits par DuckDB lui-même (COPY ... TO, multi-threadé) sans
+# passer par un DataFrame pandas. Quand pandas reste nécessaire (calculs, XLSX),
+# les données transitent en Arrow (fetch_arrow_table / ArrowDtype), sans copie
+# vers des tableaux NumPy.
+# Les XLSX sont écrits en flux (openpyxl en mode write_only) à partir de lots Arrow,
+# en mémoire constante, éventuellement dans un thread dédié (export_excel_async).
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from openpyxl import Workbook
+
+# Limite de lignes d'une feuille XLSX (1 048 576, en-tête compris)
+XLSX_MAX_ROWS = 1_048_575
+ARROW_BATCH_ROWS = 65_536
+EXCEL_WORKER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="excel")
+
+
+def as_query(source: str) -> str:
+    # Accepte un nom de table/vue ou une requête SELECT
+    return source if source.lstrip().upper().startswith(("SELECT", "WITH", "FROM")) else f"SELECT * FROM {source}"
+
+
+def export_csv(con: duckdb.DuckDBPyConnection, source: str, path: Path) -> Path:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    con.execute(f"COPY ({as_query(source)}) TO '{path}' (HEADER, DELIMITER ',')")
+    return Path(path)
+
+
+def export_parquet(con: duckdb.DuckDBPyConnection, source: str, path: Path) -> Path:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    con.execute(f"COPY ({as_query(source)}) TO '{path}' (FORMAT PARQUET)")
+    return Path(path)
+
+
+def export_partitioned(con: duckdb.DuckDBPyConnection, source: str, directory: Path, key: str) -> list[Path]:
+    # Un fichier Parquet par valeur de 'key' (arborescence Hive : key=valeur/)
+    directory = Path(directory)
+    if directory.exists():
+        shutil.rmtree(directory)
+    con.execute(f"COPY ({as_query(source)}) TO '{directory}' (FORMAT PARQUET, PARTITION_BY ({key}))")
+    return sorted(directory.rglob("*.parquet"))
+
+
+def fetch_arrow(con: duckdb.DuckDBPyConnection, source: str) -> pa.Table:
+    return con.execute(as_query(source)).fetch_arrow_table()
+
+
+def fetch_pandas(con: duckdb.DuckDBPyConnection, source: str) -> pd.DataFrame:
+    # DataFrame adossé aux buffers Arrow (ArrowDtype), sans conversion NumPy
+    return fetch_arrow(con, source).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def excel_value(value):
+    # openpyxl refuse les dates avec fuseau horaire
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    return value
+
+
+def export_excel(con: duckdb.DuckDBPyConnection, source: str, path: Path) -> Path:
+    # Pas d'écriture XLSX native dans DuckDB : lots Arrow écrits ligne à ligne dans un
+    # classeur write_only ; nouvelle feuille (Feuil2, ...) au-delà de XLSX_MAX_ROWS.
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    reader = con.execute(as_query(source)).fetch_record_batch(ARROW_BATCH_ROWS)
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows = None, XLSX_MAX_ROWS
+
+    for batch in reader:
+        columns = [column.to_pylist() for column in batch.columns]
+        for row in zip(*columns):
+            if sheet_rows == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Feuil{len(workbook.worksheets) + 1}")
+                sheet.append(reader.schema.names)
+                sheet_rows = 0
+            sheet.append([excel_value(value) for value in row])
+            sheet_rows += 1
+
+    if sheet is None:  # Résultat vide : en-tête seul
+        workbook.create_sheet("Feuil1").append(reader.schema.names)
+    workbook.save(path)
+    return Path(path)
+
+
+def export_excel_async(con: duckdb.DuckDBPyConnection, source: str, path: Path) -> Future:
+    # Export XLSX dans le thread EXCEL_WORKER, sur une connexion dédiée (cursor) ;
+    # les relations temporaires n'y étant pas visibles, elles sont exportées ici même.
+    cursor = con.cursor()
+    try:
+        cursor.execute(f"DESCRIBE {as_query(source)}")
+    except duckdb.CatalogException:
+        cursor.close()
+        future = Future()
+        future.set_result(export_excel(con, source, path))
+        return future
+
+    def run() -> Path:
+        try:
+            return export_excel(cursor, source, path)
+        finally:
+            cursor.close()
+
+    return EXCEL_WORKER.submit(run)
@@ -0,0 +1,98 @@
+# === Module history - Historique des indicateurs, en ajout seul ===
+# Chaque run ajoute un fichier Parquet horodaté par indicateur, rangé par mois de run
+# (arborescence Hive : data/history/<indicateur>/mois=AAAA-MM/run_<RUN_ID>.parquet)
+# et archivé dans MinIO sous le même chemin. Les fichiers existants ne sont jamais
+# réécrits : un run n'envoie que ses propres fichiers.
+#
+# Les requêtes de tendance lisent l'ensemble via read_parquet(..., hive_partitioning) :
+# un filtre sur 'mois' élimine les partitions, seules les colonnes utilisées sont lues.
+# Avec MINIO_DIRECT_READ=1, les vues *_historique interrogent directement MinIO
+# (httpfs) sur tout l'historique, sans téléchargement. Sinon, elles couvrent les
+# HISTORY_MONTHS derniers mois (défaut : 12, 0 = tout l'historique) : seules les
+# partitions de cette fenêtre absentes en local (runs précédents, exécutions Kestra)
+# sont téléchargées, les fichiers n'étant jamais réécrits.
+
+import os
+from pathlib import Path
+from common import RUN_ID, RUN_AT
+from exports import as_query
+from storage import DIRECT_READ, configure_duckdb_s3, s3_uri, download_files, BUCKET_NAME
+
+HISTORY_PATH = Path("data/history")
+HISTORY_PREFIX = "data/history/"
+HISTORY_MONTHS = int(os.getenv("HISTORY_MONTHS", "12"))
+
+
+def history_file(indicator: str) -> Path:
+    return HISTORY_PATH / indicator / f"mois={RUN_AT:%Y-%m}" / f"run_{RUN_ID}.parquet"
+
+
+def append_history(con, indicator: str, source: str) -> Path:
+    # Écrit le fichier du run courant (réécrit seulement si le même run est rejoué)
+    path = history_file(indicator)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    con.execute(f"""
+        COPY (
+            SELECT '{RUN_ID}' AS run_id, TIMESTAMPTZ '{RUN_AT.isoformat()}' AS run_at, *
+            FROM ({as_query(source)})
+        ) TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD)
+    """)
+    return path
+
+
+def first_month() -> str | None:
+    # Premier mois de la fenêtre locale (AAAA-MM), None si tout l'historique est lu
+    if HISTORY_MONTHS <= 0:
+        return None
+    index = RUN_AT.year * 12 + RUN_AT.month - 1 - (HISTORY_MONTHS - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def sync_history(indicator: str, s3_client) -> list[Path]:
+    # Télécharge les fichiers d'historique de la fenêtre HISTORY_MONTHS archivés dans
+    # MinIO et absents en local ; les partitions plus anciennes ne sont pas listées
+    paginator = s3_client.get_paginator("list_objects_v2")
+    start = first_month()
+    partitions = [
+        prefix["Prefix"]
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=f"{HISTORY_PREFIX}{indicator}/", Delimiter="/")
+        for prefix in page.get("CommonPrefixes", [])
+        if start is None or prefix["Prefix"].rstrip("/").rsplit("mois=", 1)[-1] >= start
+    ]
+    missing = [
+        (obj["Key"], HISTORY_PATH / obj["Key"].removeprefix(HISTORY_PREFIX))
+        for partition in partitions
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=partition)
+        for obj in page.get("Contents", [])
+        if obj["Key"].endswith(".parquet")
+        and not (HISTORY_PATH / obj["Key"].removeprefix(HISTORY_PREFIX)).exists()
+    ]
+    for _, path in missing:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    if missing:
+        download_files(missing, s3_client)
+    return [path for _, path in missing]
+
+
+def history_glob(indicator: str) -> str:
+    # Chemin absolu : la vue reste valide quel que soit le répertoire courant du lecteur
+    if DIRECT_READ:
+        return s3_uri(f"{HISTORY_PREFIX}{indicator}/*/*.parquet")
+    return (HISTORY_PATH.resolve() / indicator / "*" / "*.parquet").as_posix()
+
+
+def create_history_view(con, indicator: str, s3_client=None) -> None:
+    window = ""
+    if DIRECT_READ:
+        configure_duckdb_s3(con)
+    else:
+        if s3_client is not None:
+            sync_history(indicator, s3_client)
+        if first_month() is not None:
+            # Même fenêtre que le téléchargement, quelles que soient les partitions locales
+            window = f"WHERE mois >= '{first_month()}'"
+    con.execute(f"""
+        CREATE OR REPLACE VIEW {indicator}_historique AS
+        SELECT * FROM read_parquet('{history_glob(indicator)}', hive_partitioning = true, union_by_name = true)
+        {window}
+    """)
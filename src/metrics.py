@@ -0,0 +1,92 @@
+# === Module metrics - Métriques du pipeline enregistrées dans DuckDB ===
+# Chaque étape enregistre ses comptages, tailles et indicateurs au moment où elle
+# les produit (table 'stage_metrics'), rattachés au run courant ('pipeline_runs',
+# identifiant RUN_ID du module common). Le runner y ajoute la durée de chaque étape
+# et le rapport final (script 13) les relit en une seule requête indexée par run_id.
+# Le runner restaure METRICS_TABLES depuis MinIO au début du run et les y archive à la
+# fin (module state, data/state/) : l'historique survit aux exécutions Kestra.
+
+from datetime import datetime, timezone
+from common import RUN_ID, RUN_AT
+
+METRICS_TABLES = ["pipeline_runs", "stage_metrics"]
+
+
+def create_tables(con) -> None:
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_runs (
+            run_id VARCHAR PRIMARY KEY,
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            statut VARCHAR
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS stage_metrics (
+            run_id VARCHAR,
+            etape VARCHAR,
+            metrique VARCHAR,
+            valeur DOUBLE,
+            unite VARCHAR,
+            recorded_at TIMESTAMPTZ,
+            PRIMARY KEY (run_id, etape, metrique)
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS stage_metrics_run ON stage_metrics (run_id)")
+
+
+def start_run(con) -> None:
+    create_tables(con)
+    con.execute(
+        "INSERT OR REPLACE INTO pipeline_runs VALUES (?, ?, NULL, 'en_cours')",
+        [RUN_ID, RUN_AT],
+    )
+
+
+def finish_run(con, statut: str) -> None:
+    con.execute(
+        "UPDATE pipeline_runs SET finished_at = ?, statut = ? WHERE run_id = ?",
+        [datetime.now(timezone.utc), statut, RUN_ID],
+    )
+
+
+def record_metrics(con, etape: str, values: dict[str, float], unite: str = "lignes") -> None:
+    # Étape exécutée seule : le run est créé à la première métrique
+    create_tables(con)
+    con.execute(
+        "INSERT OR IGNORE INTO pipeline_runs VALUES (?, ?, NULL, 'en_cours')",
+        [RUN_ID, RUN_AT],
+    )
+    now = datetime.now(timezone.utc)
+    con.executemany(
+        "INSERT OR REPLACE INTO stage_metrics VALUES (?, ?, ?, ?, ?, ?)",
+        [(RUN_ID, etape, metrique, float(valeur), unite, now) for metrique, valeur in values.items()],
+    )
+
+
+def record_transfer(con, etape: str, result: dict) -> None:
+    # Bilan d'un lot upload_files / download_files (module storage)
+    record_metrics(con, etape, {"fichiers": result["files"], "fichiers_inchanges": result["skipped"]}, "fichiers")
+    record_metrics(con, etape, {"octets_transferes": result["bytes"], "octets_economises": result["saved_bytes"]}, "octets")
+    record_metrics(con, etape, {"duree_transfert": result["seconds"]}, "s")
+
+
+def run_metrics(con, run_id: str = RUN_ID) -> dict[tuple[str, str], float]:
+    # Métriques d'un run : {(etape, metrique): valeur}
+    create_tables(con)
+    rows = con.execute(
+        "SELECT etape, metrique, valeur FROM stage_metrics WHERE run_id = ?", [run_id]
+    ).fetchall()
+    return {(etape, metrique): valeur for etape, metrique, valeur in rows}
+
+
+def latest_metrics(con) -> dict[tuple[str, str], tuple[float, str]]:
+    # Dernière valeur connue de chaque métrique et run qui l'a produite, tous runs
+    # confondus (étapes lancées séparément sans PIPELINE_RUN_ID commun)
+    create_tables(con)
+    rows = con.execute("""
+        SELECT etape, metrique, arg_max(valeur, recorded_at), arg_max(run_id, recorded_at)
+        FROM stage_metrics
+        GROUP BY etape, metrique
+    """).fetchall()
+    return {(etape, metrique): (valeur, run_id) for etape, metrique, valeur, run_id in rows}
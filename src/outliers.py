@@ -0,0 +1,105 @@
+# === Module outliers - Détection de valeurs atypiques en SQL (DuckDB) ===
+# Les scores sont calculés par DuckDB (agrégats fenêtrés / quantiles), sans boucle
+# Python, puis chaque ligne est classée en une seule passe :
+#   - zscore : (x - moyenne) / écart-type            (seuil usuel : 2 ou 3)
+#   - mad    : 0.6745 * (x - médiane) / MAD          (z-score robuste, seuil usuel : 3.5)
+#   - iqr    : (x - Q3) / (Q3 - Q1), en nombre d'IQR (seuil usuel : 1.5)
+# Seules les valeurs hautes sont atypiques (vins millésimés = prix élevés).
+# Avec OUTLIER_GROUP_BY, les statistiques sont calculées par groupe (PARTITION BY /
+# GROUP BY) dans la même passe, quel que soit le nombre de groupes.
+
+import os
+from common import materialize
+
+# ----------------------------------------------------------------------
+# Paramètres (surchargeables par l'environnement)
+# ----------------------------------------------------------------------
+METHODS = ("zscore", "mad", "iqr")
+OUTLIER_METHOD = os.getenv("OUTLIER_METHOD", "zscore")
+OUTLIER_THRESHOLD = float(os.getenv("OUTLIER_THRESHOLD", "2"))
+OUTLIER_GROUP_BY = os.getenv("OUTLIER_GROUP_BY", "")
+
+# Clés de regroupement prédéfinies ; toute autre valeur est prise comme expression SQL
+GROUP_KEYS = {
+    "stock_status": "CAST(stock_status AS VARCHAR)",
+    "millesime": "NULLIF(regexp_extract(post_title, '(19|20)[0-9]{2}'), '')",
+    "tranche_prix": "CAST(CAST(10 ** floor(log10(GREATEST(price, 1))) AS INTEGER) AS VARCHAR)",  # borne basse de la décade
+}
+
+
+def group_expression(group_by: str) -> str:
+    # Les lignes sans clé forment leur propre groupe (jointures USING sur les statistiques)
+    if not group_by:
+        return "'global'"
+    return f"COALESCE(CAST({GROUP_KEYS.get(group_by, group_by)} AS VARCHAR), 'inconnu')"
+
+
+def z_score_expression(value: str) -> str:
+    # Agrégats fenêtrés par groupe (un seul groupe sans regroupement) : une seule passe
+    window = "OVER (PARTITION BY groupe)"
+    return f"({value} - avg({value}) {window}) / stddev_samp({value}) {window}"
+
+
+def score_expression(method: str, value: str) -> tuple[str | None, str]:
+    # Renvoie (requête des statistiques globales ou None, expression du score)
+    if method == "zscore":
+        return None, z_score_expression(value)
+    if method == "mad":
+        return (
+            f"""
+            SELECT groupe, med, median(abs(s.{value} - med)) AS mad
+            FROM scored_source s
+            JOIN (SELECT groupe, median({value}) AS med FROM scored_source GROUP BY groupe) USING (groupe)
+            GROUP BY groupe, med
+            """,
+            f"0.6745 * ({value} - stats.med) / NULLIF(stats.mad, 0)",
+        )
+    if method == "iqr":
+        return (
+            f"""
+            SELECT groupe, quantile_cont({value}, 0.25) AS q1, quantile_cont({value}, 0.75) AS q3
+            FROM scored_source
+            GROUP BY groupe
+            """,
+            f"({value} - stats.q3) / NULLIF(stats.q3 - stats.q1, 0)",
+        )
+    raise ValueError(f"Méthode de détection inconnue : {method} (attendu : {', '.join(METHODS)})")
+
+
+def score_outliers(
+    con,
+    name: str,
+    source: str,
+    value: str,
+    columns: list[str],
+    labels: tuple[str, str],
+    method: str = OUTLIER_METHOD,
+    threshold: float = OUTLIER_THRESHOLD,
+    group_by: str = OUTLIER_GROUP_BY,
+) -> None:
+    # Crée la table 'name' : colonnes demandées, valeur, groupe (si regroupement),
+    # z_score, score de la méthode (si autre que zscore) et étiquette (labels[0] si
+    # atypique). Un groupe d'une seule ligne n'a pas d'écart-type : score NULL.
+    stats_query, score = score_expression(method, value)
+    stats_cte = f"stats AS ({stats_query})," if stats_query else ""
+    stats_join = " JOIN stats USING (groupe)" if stats_query else ""
+    exclude = "" if group_by else " EXCLUDE (groupe)"
+    method_score = "" if method == "zscore" else f", {score} AS score"
+    outlier, regular = labels
+
+    materialize(con, name, f"""
+        WITH scored_source AS (
+            SELECT {", ".join(columns)}, CAST({value} AS DOUBLE) AS {value}, {group_expression(group_by)} AS groupe
+            FROM {source}
+            WHERE {value} IS NOT NULL
+        ),
+        {stats_cte}
+        scores AS (
+            SELECT scored_source.*, {z_score_expression('scored_source.' + value)} AS z_score{method_score}
+            FROM scored_source{stats_join}
+        )
+        SELECT *{exclude},
+            CASE WHEN {"z_score" if method == "zscore" else "score"} > {threshold}
+                 THEN '{outlier}' ELSE '{regular}' END AS type
+        FROM scores
+    """, "kpi")
@@ -0,0 +1,175 @@
+# === Runner - Exécution du pipeline complet dans un seul processus Python ===
+# Ce script importe les étapes 'src/NN_*.py' comme des fonctions et les exécute
+# dans l'ordre du workflow Kestra, en partageant une seule connexion DuckDB
+# et un seul client MinIO. Les scripts de tests sont rejoués dans le même
+# interpréteur et la durée de chaque étape est journalisée puis exportée.
+# Le run et la durée de chaque étape sont enregistrés dans DuckDB (module metrics :
+# tables 'pipeline_runs' et 'stage_metrics'), restaurées depuis MinIO au démarrage et
+# archivées dans MinIO en fin de run (data/state/).
+#
+# Usage : python src/run_pipeline.py [--stages 05 05b 08] [--skip-tests]
+
+import argparse
+import duckdb
+import importlib
+import inspect
+import runpy
+import time
+import pandas as pd
+from pathlib import Path
+from loguru import logger
+import sys
+import warnings
+from common import setup_logger, connect_duckdb, RUN_ID
+from storage import get_s3_client
+from metrics import create_tables, start_run, finish_run, record_metrics, METRICS_TABLES
+from state import restore_tables, archive_tables
+
+warnings.filterwarnings("ignore")
+
+# ----------------------------------------------------------------------
+# Paramètres
+# ----------------------------------------------------------------------
+SRC_PATH = Path(__file__).resolve().parent
+TESTS_PATH = SRC_PATH.parent / "tests"
+OUTPUTS_PATH = Path("data/outputs")
+
+# Ordre du workflow Kestra : (identifiant, module de l'étape, scripts de tests associés)
+PIPELINE = [
+    ("00", "00_download_and_extract", []),
+    ("01", "01_excel_to_csv", []),
+    ("02", "02_upload_to_minio", []),
+    ("03", "03_verify_upload", []),
+    ("05", "05_clean_data", ["test_05_clean_data.py", "test_05_nulls_clean_data.py"]),
+    ("05b", "05b_detect_changes", []),
+    ("06", "06_upload_clean_to_minio", []),
+    ("08", "08_dedoublonnage", ["test_08_dedoublonnage.py", "test_08_doublons.py", "test_08_incremental_dedup.py"]),
+    ("09", "09_fusion", ["test_09_fusion.py"]),
+    ("10", "10_create_snapshot", ["test_10_snapshot_restore.py"]),
+    ("11", "11_calcul_ca", ["test_11_validate_ca.py"]),
+    ("12", "12_calcul_zscore_upload", ["test_12_validate_zscore.py", "test_12_running_stats.py"]),
+    ("13", "13_generate_final_report", []),
+    ("14", "14_upload_all_logs", []),
+]
+
+
+# ----------------------------------------------------------------------
+# Exécution d'une étape ou d'un test
+# ----------------------------------------------------------------------
+def run_stage(module_name: str, shared: dict) -> None:
+    # Les modules commencent par un chiffre : import via importlib uniquement
+    module = importlib.import_module(module_name)
+    accepted = inspect.signature(module.main).parameters
+    module.main(**{k: v for k, v in shared.items() if k in accepted})
+
+
+def run_test(test_filename: str, con) -> None:
+    # Les tests reçoivent la connexion du runner : ils voient les tables temporaires
+    runpy.run_path(str(TESTS_PATH / test_filename), init_globals={"RUNNER_CON": con}, run_name="__main__")
+
+
+def timed(func, *args) -> tuple[float, str]:
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        func(*args)
+    except SystemExit as e:
+        # Les étapes signalent leurs erreurs via exit(1)
+        if e.code not in (None, 0):
+            status = "echec"
+    except Exception as e:
+        # Erreur hors des blocs try des scripts : le run est tout de même enregistré
+        logger.exception(f"❌ Exception non gérée dans {args[0]} : {e}")
+        status = "echec"
+    return time.perf_counter() - start, status
+
+
+def export_metrics(shared: dict) -> None:
+    # Archive les tables de métriques dans MinIO ; un échec n'invalide pas le run
+    try:
+        archive_tables(shared["con"], METRICS_TABLES, shared["s3_client"])
+        logger.info("📤 Métriques du run archivées dans MinIO (data/state/).")
+    except Exception as e:
+        logger.warning(f"⚠️ Archivage des métriques dans MinIO impossible : {e}")
+
+
+# ----------------------------------------------------------------------
+# Pipeline complet
+# ----------------------------------------------------------------------
+def run_pipeline(stage_ids: list[str] | None = None, with_tests: bool = True) -> pd.DataFrame:
+    if str(SRC_PATH) not in sys.path:
+        sys.path.insert(0, str(SRC_PATH))
+
+    setup_logger("run_pipeline.log")
+    logger.info("🚀 Démarrage du pipeline mono-processus...")
+
+    shared = {
+        "con": connect_duckdb(runner=True),
+        "s3_client": get_s3_client(),
+    }
+
+    # Historique des runs précédents (base locale vide dans une exécution Kestra)
+    try:
+        create_tables(shared["con"])
+        restored = restore_tables(shared["con"], METRICS_TABLES, shared["s3_client"])
+        if restored:
+            logger.info(f"♻️  Métriques des runs précédents restaurées depuis MinIO : {restored}")
+    except Exception as e:
+        logger.warning(f"⚠️ Métriques des runs précédents non restaurées : {e}")
+
+    start_run(shared["con"])
+    logger.info(f"🆔 Run {RUN_ID}")
+
+    timings = []
+    for stage_id, module_name, tests in PIPELINE:
+        if stage_ids and stage_id not in stage_ids:
+            continue
+
+        steps = [(module_name, run_stage, module_name, shared)]
+        if with_tests:
+            steps += [(test, run_test, test, shared["con"]) for test in tests]
+
+        for label, func, *args in steps:
+            duration, status = timed(func, *args)
+            # Chaque étape reconfigure loguru : on revient au log du runner
+            setup_logger("run_pipeline.log")
+            if status != "ok":
+                # Transaction éventuellement laissée ouverte par l'étape en échec
+                try:
+                    shared["con"].execute("ROLLBACK")
+                except duckdb.Error:
+                    pass
+            timings.append({"etape": label, "duree_s": round(duration, 3), "statut": status})
+            logger.info(f"⏱️  {label} : {duration:.2f} s ({status})")
+            record_metrics(shared["con"], label, {"duree": duration}, "s")
+
+            if status != "ok":
+                logger.error(f"❌ Arrêt du pipeline : échec de l'étape {label}")
+                finish_run(shared["con"], "echec")
+                export_metrics(shared)
+                return pd.DataFrame(timings)
+
+    finish_run(shared["con"], "ok")
+    export_metrics(shared)
+    return pd.DataFrame(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Exécute le pipeline BottleNeck dans un seul processus.")
+    parser.add_argument("--stages", nargs="*", help="Identifiants des étapes à exécuter (ex. 05 08 09)")
+    parser.add_argument("--skip-tests", action="store_true", help="N'exécute pas les scripts de tests")
+    args = parser.parse_args()
+
+    df_timings = run_pipeline(args.stages, with_tests=not args.skip_tests)
+
+    OUTPUTS_PATH.mkdir(parents=True, exist_ok=True)
+    df_timings.to_csv(OUTPUTS_PATH / "pipeline_timings.csv", index=False)
+    logger.info(f"📊 Durée totale : {df_timings['duree_s'].sum():.2f} s")
+
+    if (df_timings["statut"] != "ok").any():
+        sys.exit(1)
+    logger.success("🎉 Pipeline complet exécuté avec succès.")
+
+
+if __name__ == "__main__":
+    main()
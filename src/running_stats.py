@@ -0,0 +1,264 @@
+# === Module running_stats - Statistiques de prix maintenues incrémentalement ===
+# La table 'price_stats' conserve, par groupe, l'effectif, la moyenne et M2
+# (somme des carrés des écarts, forme de Welford). Elle est mise à jour à partir
+# des seuls produits ajoutés, modifiés ou retirés (tables *_delta du script 05b),
+# en combinant les statistiques de lots (algorithme parallèle de Chan et al.).
+# Les produits concernés sont scorés contre la distribution à jour, en O(delta), et
+# la table de scores du run précédent est mise à jour sans agrégat sur 'fusion'
+# (rescore_outliers). Un recalcul complet périodique applique le delta puis mesure
+# la dérive numérique par rapport aux valeurs exactes ; une resynchronisation (état
+# absent ou décalé) ou un recalcul forcé (PRICE_STATS_MODE=full) ne mesure rien.
+#
+# Variables d'environnement :
+#   PRICE_STATS_MODE       incremental (défaut) | full
+#   PRICE_STATS_FULL_EVERY recalcul complet tous les N runs (défaut : 12)
+#   PRICE_STATS_GROUP      colonne de 'fusion' pour des statistiques par catégorie (optionnel)
+#
+# Les tables STATE_TABLES sont archivées dans MinIO par le script 12 (module state)
+# pour survivre aux exécutions Kestra, qui repartent d'une base vide.
+
+import math
+import os
+from common import relation_exists
+
+# ----------------------------------------------------------------------
+# Paramètres
+# ----------------------------------------------------------------------
+PRICE_STATS_MODE = os.getenv("PRICE_STATS_MODE", "incremental")
+PRICE_STATS_FULL_EVERY = int(os.getenv("PRICE_STATS_FULL_EVERY", "12"))
+PRICE_STATS_GROUP = os.getenv("PRICE_STATS_GROUP", "")
+GLOBAL_GROUP = "global"
+DRIFT_TOLERANCE = 1e-9  # Écart relatif toléré entre valeurs maintenues et exactes
+STATE_TABLES = ["price_stats", "price_stats_members", "price_stats_state"]
+
+
+def create_tables(con) -> None:
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS price_stats (
+            groupe VARCHAR PRIMARY KEY, n BIGINT, mean DOUBLE, m2 DOUBLE
+        )
+    """)
+    # Valeurs actuellement comptabilisées dans les statistiques
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS price_stats_members (
+            product_id BIGINT PRIMARY KEY, categorie VARCHAR, price DOUBLE
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS price_stats_state (
+            id INTEGER PRIMARY KEY, runs_since_full INTEGER, empreinte VARCHAR
+        )
+    """)
+
+
+def fusion_members_query(where: str = "TRUE") -> str:
+    categorie = f"CAST({PRICE_STATS_GROUP} AS VARCHAR)" if PRICE_STATS_GROUP else "NULL"
+    return f"""
+        SELECT product_id, {categorie} AS categorie, CAST(price AS DOUBLE) AS price
+        FROM fusion
+        WHERE price IS NOT NULL AND {where}
+    """
+
+
+def batch_stats(con, members: str) -> dict[str, tuple[int, float, float]]:
+    # (n, moyenne, M2) par groupe pour un lot de membres
+    rows = con.execute(f"""
+        WITH lot AS ({members}),
+        grouped AS (
+            SELECT '{GLOBAL_GROUP}' AS groupe, price FROM lot
+            UNION ALL
+            SELECT categorie, price FROM lot WHERE categorie IS NOT NULL
+        )
+        SELECT groupe, COUNT(*), avg(price), COALESCE(var_pop(price), 0) * COUNT(*)
+        FROM grouped
+        GROUP BY groupe
+    """).fetchall()
+    return {groupe: (n, mean, m2) for groupe, n, mean, m2 in rows}
+
+
+# ----------------------------------------------------------------------
+# Combinaison de statistiques (Welford / Chan et al.)
+# ----------------------------------------------------------------------
+def combine(a: tuple[int, float, float], b: tuple[int, float, float]) -> tuple[int, float, float]:
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+
+def remove(total: tuple[int, float, float], b: tuple[int, float, float]) -> tuple[int, float, float]:
+    n_t, mean_t, m2_t = total
+    n_b, mean_b, m2_b = b
+    n_a = n_t - n_b
+    if n_a <= 0:
+        return 0, 0.0, 0.0
+    mean_a = (n_t * mean_t - n_b * mean_b) / n_a
+    delta = mean_b - mean_a
+    return n_a, mean_a, max(m2_t - m2_b - delta * delta * n_a * n_b / n_t, 0.0)
+
+
+def std(stats: tuple[int, float, float]) -> float:
+    n, _, m2 = stats
+    return math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+
+
+# ----------------------------------------------------------------------
+# Mise à jour
+# ----------------------------------------------------------------------
+def current_stats(con) -> dict[str, tuple[int, float, float]]:
+    return {groupe: (n, mean, m2) for groupe, n, mean, m2 in con.execute("SELECT * FROM price_stats").fetchall()}
+
+
+def save_stats(con, stats: dict[str, tuple[int, float, float]]) -> None:
+    con.execute("DELETE FROM price_stats")
+    con.executemany("INSERT INTO price_stats VALUES (?, ?, ?, ?)", [(g, *s) for g, s in stats.items() if s[0] > 0])
+
+
+def delta_fingerprint(con) -> tuple[str, str] | None:
+    # Empreintes des deltas du script 05b : (run précédent, run courant)
+    if not relation_exists(con, "delta_summary"):
+        return None
+    rows = con.execute(
+        "SELECT empreinte_precedente, empreinte_courante FROM delta_summary ORDER BY source"
+    ).fetchall()
+    return ("|".join(r[0] for r in rows), "|".join(r[1] for r in rows))
+
+
+def full_recompute(con, check_drift: bool = False) -> dict[str, float]:
+    # Valeurs exactes ; avec check_drift, renvoie l'écart relatif maximal avec les
+    # valeurs maintenues (qui doivent alors être à jour du run courant)
+    maintained = current_stats(con)
+    exact = batch_stats(con, fusion_members_query())
+
+    drift = {}
+    for groupe, stats in exact.items():
+        if check_drift and groupe in maintained:
+            drift[groupe] = max(
+                abs(maintained[groupe][1] - stats[1]) / max(abs(stats[1]), 1e-12),
+                abs(std(maintained[groupe]) - std(stats)) / max(std(stats), 1e-12),
+            )
+
+    save_stats(con, exact)
+    con.execute("DELETE FROM price_stats_members")
+    con.execute(f"INSERT INTO price_stats_members {fusion_members_query()}")
+    return drift
+
+
+def apply_delta(con) -> int:
+    # Retire les anciennes valeurs des produits touchés, ajoute les nouvelles.
+    # Renvoie le nombre de produits ajoutés ou modifiés (scorés dans 'prix_nouveaux_scores').
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE price_candidates AS
+        SELECT product_id FROM erp_delta
+        UNION SELECT product_id FROM liaison_delta
+        UNION SELECT l.product_id FROM liaison_dedup l JOIN web_delta w ON l.id_web = w.sku
+    """)
+    candidates = "product_id IN (SELECT product_id FROM price_candidates)"
+    con.execute(f"CREATE OR REPLACE TEMP TABLE price_new AS {fusion_members_query(candidates)}")
+
+    # Lots retirés / ajoutés (les produits inchangés s'annulent et sont ignorés)
+    removed = f"""
+        SELECT * FROM price_stats_members WHERE {candidates}
+        EXCEPT SELECT * FROM price_new
+    """
+    added = f"""
+        SELECT * FROM price_new
+        EXCEPT SELECT * FROM price_stats_members WHERE {candidates}
+    """
+    con.execute(f"CREATE OR REPLACE TEMP TABLE price_added AS {added}")
+
+    stats = current_stats(con)
+    for groupe, batch in batch_stats(con, removed).items():
+        stats[groupe] = remove(stats.get(groupe, (0, 0.0, 0.0)), batch)
+    for groupe, batch in batch_stats(con, "SELECT * FROM price_added").items():
+        stats[groupe] = combine(stats.get(groupe, (0, 0.0, 0.0)), batch)
+    save_stats(con, stats)
+
+    con.execute(f"DELETE FROM price_stats_members WHERE {candidates}")
+    con.execute("INSERT INTO price_stats_members SELECT * FROM price_new")
+
+    # Scores des produits ajoutés ou modifiés contre la distribution à jour
+    con.execute(f"""
+        CREATE OR REPLACE TABLE prix_nouveaux_scores AS
+        SELECT
+            a.product_id, a.categorie, a.price,
+            (a.price - g.mean) / sqrt(g.m2 / (g.n - 1)) AS z_score,
+            (a.price - c.mean) / sqrt(c.m2 / NULLIF(c.n - 1, 0)) AS z_score_categorie
+        FROM price_added a
+        CROSS JOIN (SELECT * FROM price_stats WHERE groupe = '{GLOBAL_GROUP}') g
+        LEFT JOIN price_stats c ON c.groupe = a.categorie
+    """)
+    return con.execute("SELECT COUNT(*) FROM price_added").fetchone()[0]
+
+
+def update_price_stats(con) -> dict:
+    # Point d'entrée : choisit entre mise à jour incrémentale et recalcul complet
+    create_tables(con)
+    state = con.execute("SELECT runs_since_full, empreinte FROM price_stats_state WHERE id = 1").fetchone()
+    fingerprints = delta_fingerprint(con)
+
+    in_sync = (
+        state is not None
+        and fingerprints is not None
+        and state[1] == fingerprints[0]
+        and all(relation_exists(con, f"{name}_delta") for name in ("erp", "web", "liaison"))
+    )
+    due = state is None or state[0] + 1 >= PRICE_STATS_FULL_EVERY
+
+    if PRICE_STATS_MODE == "full" or not in_sync:
+        # Recalcul forcé ou resynchronisation : les valeurs maintenues ne sont pas
+        # celles du run courant, aucune dérive n'est mesurée
+        result = {"mode": "full", "drift": full_recompute(con)}
+        runs_since_full = 0
+    elif due:
+        # Contrôle périodique : delta appliqué, puis comparaison au recalcul exact
+        apply_delta(con)
+        result = {"mode": "full", "drift": full_recompute(con, check_drift=True)}
+        runs_since_full = 0
+    else:
+        result = {"mode": "incremental", "scored": apply_delta(con)}
+        runs_since_full = state[0] + 1
+
+    con.execute(
+        "INSERT OR REPLACE INTO price_stats_state VALUES (1, ?, ?)",
+        [runs_since_full, fingerprints[1] if fingerprints else None],
+    )
+    result["stats"] = current_stats(con)
+    return result
+
+
+def rescore_outliers(con, name: str, threshold: float, labels: tuple[str, str]) -> bool:
+    # Met à jour la table de scores 'name' du run précédent (score_outliers, z-score
+    # global, colonnes product_id, post_title, price, z_score, type) après apply_delta :
+    # produits touchés retirés, produits touchés encore présents dans 'fusion' réinsérés,
+    # puis z-score de chaque ligne recalculé avec la moyenne et l'écart-type maintenus
+    # (price_stats), sans agrégat fenêtré sur 'fusion'. Renvoie False si la table
+    # précédente est absente ou d'un autre format : le score complet reste nécessaire.
+    columns = ["product_id", "post_title", "price", "z_score", "type"]
+    if not relation_exists(con, name) or not relation_exists(con, "price_candidates"):
+        return False
+    if [row[0] for row in con.execute(f"DESCRIBE {name}").fetchall()] != columns:
+        return False
+
+    outlier, regular = labels
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {name} AS
+        WITH lignes AS (
+            SELECT product_id, post_title, price FROM {name}
+            WHERE product_id NOT IN (SELECT product_id FROM price_candidates)
+            UNION ALL
+            SELECT product_id, post_title, CAST(price AS DOUBLE) AS price FROM fusion
+            WHERE price IS NOT NULL AND product_id IN (SELECT product_id FROM price_new)
+        ),
+        scores AS (
+            SELECT r.*, (r.price - g.mean) / sqrt(g.m2 / NULLIF(g.n - 1, 0)) AS z_score
+            FROM lignes r
+            CROSS JOIN (SELECT * FROM price_stats WHERE groupe = '{GLOBAL_GROUP}') g
+        )
+        SELECT *, CASE WHEN z_score > {threshold} THEN '{outlier}' ELSE '{regular}' END AS type
+        FROM scores
+    """)
+    return True
@@ -0,0 +1,194 @@
+# === Module schemas - Registre des schémas déclarés (erp, web, liaison) ===
+# Les colonnes et types de chaque source sont déclarés ici une fois pour toutes
+# et transmis explicitement à chaque lecture CSV ou Parquet : DuckDB n'échantillonne
+# plus les fichiers (aucun sniffing) et utilise directement le lecteur CSV
+# parallèle typé. Toute dérive (colonne ajoutée, retirée, renommée ou retypée)
+# est détectée immédiatement via une empreinte du schéma.
+# Types compacts : ENUM pour les colonnes catégorielles, DECIMAL pour les montants ;
+# la couche web nettoyée ne porte que les colonnes utiles au reste du pipeline.
+
+import hashlib
+import json
+
+# ==============================================================================
+# Types compacts
+# ==============================================================================
+def enum_type(*values: str) -> str:
+    # Valeurs triées : MIN/MAX sur l'ENUM donnent le même résultat que sur le texte
+    return "ENUM(" + ", ".join(f"'{value}'" for value in sorted(values)) + ")"
+
+
+MONEY = "DECIMAL(10,2)"
+STOCK_STATUS = enum_type("instock", "onbackorder", "outofstock")
+TAX_STATUS = enum_type("none", "shipping", "taxable")
+POST_STATUS = enum_type("auto-draft", "draft", "future", "inherit", "pending", "private", "publish", "trash")
+POST_TYPE = enum_type("attachment", "nav_menu_item", "page", "post", "product", "product_variation", "revision")
+OPEN_CLOSED = enum_type("closed", "open")
+
+# ==============================================================================
+# Schémas déclarés (ordre des colonnes = ordre des fichiers sources)
+# ==============================================================================
+SCHEMAS = {
+    "erp": {
+        "product_id": "BIGINT",
+        "onsale_web": "TINYINT",
+        "price": MONEY,
+        "stock_quantity": "INTEGER",
+        "stock_status": STOCK_STATUS,
+    },
+    "web": {
+        "sku": "VARCHAR",  # Mélange de codes numériques et textuels
+        "virtual": "TINYINT",
+        "downloadable": "TINYINT",
+        "rating_count": "INTEGER",
+        "average_rating": "DOUBLE",
+        "total_sales": "INTEGER",
+        "tax_status": TAX_STATUS,
+        "tax_class": "VARCHAR",
+        "post_author": "INTEGER",
+        "post_date": "TIMESTAMP",
+        "post_date_gmt": "TIMESTAMP",
+        "post_content": "VARCHAR",
+        "post_title": "VARCHAR",
+        "post_excerpt": "VARCHAR",
+        "post_status": POST_STATUS,
+        "comment_status": OPEN_CLOSED,
+        "ping_status": OPEN_CLOSED,
+        "post_password": "VARCHAR",
+        "post_name": "VARCHAR",
+        "post_modified": "TIMESTAMP",
+        "post_modified_gmt": "TIMESTAMP",
+        "post_content_filtered": "VARCHAR",
+        "post_parent": "BIGINT",
+        "guid": "VARCHAR",
+        "menu_order": "INTEGER",
+        "post_type": POST_TYPE,
+        "post_mime_type": "VARCHAR",
+        "comment_count": "INTEGER",
+    },
+    "liaison": {
+        "product_id": "BIGINT",
+        "id_web": "VARCHAR",  # Jointure avec web.sku
+    },
+}
+
+# Colonnes web utilisées par le dédoublonnage et la fusion ; le texte lourd
+# (contenu, guid, slugs...) reste dans la table annexe 'web_text'
+WEB_CLEAN_COLUMNS = [
+    "sku", "post_date", "post_type", "post_status",
+    "post_title", "post_excerpt", "average_rating", "total_sales",
+]
+WEB_TEXT_COLUMNS = ["sku", "post_date", "post_type"] + [
+    col for col in SCHEMAS["web"] if col not in WEB_CLEAN_COLUMNS
+]
+
+# Schémas des couches nettoyées (fichiers *_clean.csv / *_clean.parquet)
+SCHEMAS["erp_clean"] = SCHEMAS["erp"]
+SCHEMAS["liaison_clean"] = SCHEMAS["liaison"]
+SCHEMAS["web_clean"] = {col: SCHEMAS["web"][col] for col in WEB_CLEAN_COLUMNS}
+
+
+class SchemaDriftError(Exception):
+    # Le fichier ou la table lu ne correspond plus au schéma déclaré
+    pass
+
+
+# ==============================================================================
+# Empreinte de schéma
+# ==============================================================================
+def schema_fingerprint(columns: list[tuple[str, str]]) -> str:
+    return hashlib.sha256(json.dumps(columns).encode()).hexdigest()[:16]
+
+
+FINGERPRINTS = {name: schema_fingerprint(list(schema.items())) for name, schema in SCHEMAS.items()}
+
+
+def check_columns(name: str, found: list[str]) -> None:
+    # Contrôle des noms et de l'ordre des colonnes (en-tête CSV, classeur Excel)
+    expected = list(SCHEMAS[name])
+    if list(found) != expected:
+        missing = [col for col in expected if col not in found]
+        extra = [col for col in found if col not in expected]
+        raise SchemaDriftError(
+            f"{name} : colonnes inattendues (manquantes : {missing}, en trop : {extra}, "
+            f"ordre attendu : {expected})"
+        )
+
+
+def storage_type(col_type: str) -> str:
+    # Les ENUM sont écrits en texte dans les fichiers CSV et Parquet
+    return "VARCHAR" if col_type.startswith("ENUM") else col_type
+
+
+def check_relation(con, name: str, relation: str, in_file: bool = False) -> None:
+    # Contrôle noms + types d'une table ou d'un Parquet (métadonnées seulement)
+    expected = [(col, storage_type(t) if in_file else t) for col, t in SCHEMAS[name].items()]
+    found = [(col, col_type) for col, col_type, *_ in con.execute(f"DESCRIBE SELECT * FROM {relation}").fetchall()]
+    if schema_fingerprint(found) != schema_fingerprint(expected):
+        drift = sorted(set(found) ^ set(expected))
+        raise SchemaDriftError(f"{name} : empreinte de schéma différente de {FINGERPRINTS[name]} ({drift})")
+
+
+# ==============================================================================
+# Lectures typées
+# ==============================================================================
+def columns_struct(name: str) -> str:
+    # Paramètre 'columns' de read_csv : {'col': 'TYPE', ...}
+    return "{" + ", ".join(f"'{col}': '{storage_type(col_type)}'" for col, col_type in SCHEMAS[name].items()) + "}"
+
+
+def guarded_cast(name: str, col: str, col_type: str) -> str:
+    # Conversion d'une colonne avec contrôle des valeurs, dans la même passe que le CAST :
+    # - ENUM : ensemble fermé, une valeur absente de schemas.py (nouveau statut WordPress
+    #   ou ERP) lève une erreur qui nomme la colonne et la valeur ;
+    # - DECIMAL : un montant avec plus de décimales que l'échelle déclarée est refusé
+    #   plutôt qu'arrondi en silence (les prix sources sont saisis au centime).
+    value = f'"{col}"'
+    label = f"{name}.{col}"
+    if col_type.startswith("ENUM"):
+        return (
+            f"CASE WHEN {value} IS NOT NULL AND TRY_CAST({value} AS {col_type}) IS NULL "
+            f"THEN error('{label} : valeur absente de l''ENUM déclaré (schemas.py) : ' || CAST({value} AS VARCHAR)) "
+            f"ELSE CAST({value} AS {col_type}) END"
+        )
+    if col_type.startswith("DECIMAL"):
+        scale = int(col_type.rstrip(")").split(",")[1])
+        as_double = f"TRY_CAST({value} AS DOUBLE)"
+        return (
+            f"CASE WHEN abs({as_double} - round({as_double}, {scale})) > 1e-9 "
+            f"THEN error('{label} : plus de {scale} décimales, arrondi refusé : ' || CAST({value} AS VARCHAR)) "
+            f"ELSE CAST({value} AS {col_type}) END"
+        )
+    return f"CAST({value} AS {col_type})"
+
+
+def cast_projection(name: str, relation: str) -> str:
+    # Projection explicite vers le schéma déclaré (échoue si une valeur ne convertit pas)
+    casts = ", ".join(f'{guarded_cast(name, col, col_type)} AS "{col}"' for col, col_type in SCHEMAS[name].items())
+    return f"SELECT {casts} FROM {relation}"
+
+
+def read_csv_typed(con, name: str, path: str) -> str:
+    # Vérifie l'en-tête puis renvoie un lecteur CSV sans détection automatique
+    header_columns = {f"c{i}": "VARCHAR" for i in range(len(SCHEMAS[name]))}
+    try:
+        header = con.execute(f"""
+            SELECT * FROM read_csv('{path}', header = false, auto_detect = false,
+                                   delim = ',', quote = '"', columns = {header_columns})
+            LIMIT 1
+        """).fetchone()
+    except Exception as e:
+        raise SchemaDriftError(f"{name} : en-tête illisible avec le schéma déclaré ({e})") from e
+    check_columns(name, list(header or []))
+
+    reader = (
+        f"read_csv('{path}', header = true, auto_detect = false, delim = ',', quote = '\"', "
+        f"columns = {columns_struct(name)})"
+    )
+    return f"({cast_projection(name, reader)})"
+
+
+def read_parquet_typed(con, name: str, path: str) -> str:
+    relation = f"read_parquet('{path}')"
+    check_relation(con, name, relation, in_file=True)
+    return f"({cast_projection(name, relation)})"
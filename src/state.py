@@ -0,0 +1,68 @@
+# === Module state - Tables d'état conservées d'un run à l'autre dans MinIO ===
+# Une exécution Kestra démarre dans un répertoire vierge : la base DuckDB locale
+# est perdue. Les tables nécessaires au run suivant (empreintes du script 05b,
+# statistiques de prix, état du dédoublonnage incrémental) sont donc archivées en
+# Parquet sous 'data/state/<table>.parquet' et rechargées au début de l'étape.
+
+from pathlib import Path
+from common import relation_exists
+from storage import get_s3_client, upload_files, download_files, BUCKET_NAME
+
+STATE_PATH = Path("data/state")
+STATE_PREFIX = "data/state/"
+
+
+def state_file(table: str) -> Path:
+    return STATE_PATH / f"{table}.parquet"
+
+
+def is_empty(con, table: str) -> bool:
+    return not relation_exists(con, table) or con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0
+
+
+def restore_tables(con, tables: list[str], s3_client=None, primary_keys: dict[str, str] | None = None) -> list[str]:
+    # Recharge les tables absentes ou vides de la base locale depuis l'archive MinIO.
+    # Une table déjà créée (avec sa clé primaire) est remplie par INSERT ; une table
+    # absente est créée depuis le Parquet, avec la clé primaire de 'primary_keys'
+    # si elle y figure. Renvoie les tables restaurées.
+    primary_keys = primary_keys or {}
+    missing = [table for table in tables if is_empty(con, table)]
+    if not missing:
+        return []
+
+    s3_client = s3_client or get_s3_client()
+    STATE_PATH.mkdir(parents=True, exist_ok=True)
+    response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=STATE_PREFIX)
+    archived = {obj["Key"] for obj in response.get("Contents", [])}
+    transfers = [
+        (f"{STATE_PREFIX}{table}.parquet", state_file(table))
+        for table in missing
+        if f"{STATE_PREFIX}{table}.parquet" in archived
+    ]
+    if transfers:
+        download_files(transfers, s3_client)
+
+    restored = []
+    for table in missing:
+        parquet_path = state_file(table)
+        if not parquet_path.exists():
+            continue
+        source = f"SELECT * FROM read_parquet('{parquet_path}')"
+        if relation_exists(con, table):
+            con.execute(f"INSERT INTO {table} {source}")
+        elif table in primary_keys:
+            columns = ", ".join(f'"{col}" {col_type}' for col, col_type, *_ in con.execute(f"DESCRIBE {source}").fetchall())
+            con.execute(f"CREATE TABLE {table} ({columns}, PRIMARY KEY ({primary_keys[table]}))")
+            con.execute(f"INSERT INTO {table} {source}")
+        else:
+            con.execute(f"CREATE TABLE {table} AS {source}")
+        restored.append(table)
+    return restored
+
+
+def archive_tables(con, tables: list[str], s3_client=None) -> dict:
+    # Exporte les tables d'état et les envoie dans MinIO (inchangées : ignorées en mode sync)
+    STATE_PATH.mkdir(parents=True, exist_ok=True)
+    for table in tables:
+        con.execute(f"COPY {table} TO '{state_file(table)}' (FORMAT PARQUET)")
+    return upload_files([(state_file(table), f"{STATE_PREFIX}{table}.parquet") for table in tables], s3_client)
@@ -25,7 +25,8 @@ logger.add(LOGS_PATH / "test_08_dedoublonnage.log", level="INFO", rotation="500
 # Connexion à DuckDB
 # ----------------------------------------------------------------------
 try:
-    con = duckdb.connect("data/bottleneck.duckdb")
+    # Connexion du runner si fournie (tables temporaires visibles), sinon base locale
+    con = globals().get("RUNNER_CON") or duckdb.connect("data/bottleneck.duckdb")
     logger.info("🧪 Connexion à DuckDB réussie.")
 except Exception as e:
     logger.error(f"❌ Connexion échouée : {e}")
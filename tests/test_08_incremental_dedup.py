@@ -0,0 +1,74 @@
+# === Script de test 08 - Équivalence du dédoublonnage incrémental ===
+# Ce script recalcule entièrement le dédoublonnage à partir des tables nettoyées et
+# vérifie que erp_dedup, web_dedup et liaison_dedup contiennent exactement le même
+# résultat, qu'elles aient été reconstruites ou mises à jour par DEDUP_MODE=incremental.
+
+import duckdb
+from pathlib import Path
+from loguru import logger
+import sys
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# ----------------------------------------------------------------------
+# Logger
+# ----------------------------------------------------------------------
+logger.remove()
+logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
+logger.add(sys.stderr, level="WARNING")
+
+LOGS_PATH = Path("logs")
+LOGS_PATH.mkdir(parents=True, exist_ok=True)
+logger.add(LOGS_PATH / "test_08_incremental_dedup.log", level="INFO", rotation="500 KB")
+
+# ----------------------------------------------------------------------
+# Connexion à DuckDB
+# ----------------------------------------------------------------------
+try:
+    # Connexion du runner si fournie (tables temporaires visibles), sinon base locale
+    con = globals().get("RUNNER_CON") or duckdb.connect("data/bottleneck.duckdb")
+    logger.info("🧪 Connexion à DuckDB réussie.")
+except Exception as e:
+    logger.error(f"❌ Connexion échouée : {e}")
+    exit(1)
+
+# ----------------------------------------------------------------------
+# Recalcul complet de référence (mêmes règles que le script 08)
+# ----------------------------------------------------------------------
+# web : plusieurs lignes peuvent partager la post_date la plus récente d'un sku,
+# on compare donc la clé et la date retenue
+REFERENCES = {
+    "erp_dedup": ("*", """
+        SELECT product_id, MAX(onsale_web), MAX(price), MAX(stock_quantity), MAX(stock_status)
+        FROM erp_clean
+        GROUP BY product_id
+    """),
+    "liaison_dedup": ("*", """
+        SELECT product_id, MIN(id_web) FROM liaison_clean GROUP BY product_id
+    """),
+    "web_dedup": ("sku, post_date", """
+        SELECT sku, MAX(post_date) FROM web_clean WHERE post_type = 'product' GROUP BY sku
+    """),
+}
+
+# ----------------------------------------------------------------------
+# Comparaison ligne à ligne (dans les deux sens, doublons compris)
+# ----------------------------------------------------------------------
+try:
+    for table_name, (columns, reference) in REFERENCES.items():
+        extra, missing = con.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT {columns} FROM {table_name} EXCEPT ALL {reference})),
+                (SELECT COUNT(*) FROM ({reference} EXCEPT ALL SELECT {columns} FROM {table_name}))
+        """).fetchone()
+        assert extra == 0 and missing == 0, (
+            f"❌ {table_name} diffère du recalcul complet : {extra} ligne(s) en trop, {missing} manquante(s)"
+        )
+        logger.success(f"✅ {table_name} identique au recalcul complet.")
+
+    logger.success("🎯 Test d'équivalence du dédoublonnage réussi.")
+
+except Exception as e:
+    logger.error(f"❌ Erreur lors du test d'équivalence du dédoublonnage : {e}")
+    exit(1)
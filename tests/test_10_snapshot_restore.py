@@ -0,0 +1,115 @@
+# === Script de test 10 - Restauration du dernier snapshot ===
+# Ce script restaure le snapshot le plus récent (manifeste de data/snapshots/manifests/)
+# dans une base temporaire avec restore_snapshot, puis vérifie que chaque table restaurée
+# a le même contenu que son objet Parquet, et que les vues et index sont recréés.
+# Un second cas ajoute au manifeste une vue d'historique sur des fichiers absents :
+# elle est ignorée (avec la vue qui en dépend) sans bloquer la restauration.
+
+import importlib
+import json
+import tempfile
+import duckdb
+from pathlib import Path
+from loguru import logger
+import sys
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# ----------------------------------------------------------------------
+# Logger
+# ----------------------------------------------------------------------
+logger.remove()
+logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
+logger.add(sys.stderr, level="WARNING")
+
+LOGS_PATH = Path("logs")
+LOGS_PATH.mkdir(parents=True, exist_ok=True)
+logger.add(LOGS_PATH / "test_10_snapshot_restore.log", level="INFO", rotation="500 KB")
+
+# ----------------------------------------------------------------------
+# Import du script 10 (nom commençant par un chiffre : importlib)
+# ----------------------------------------------------------------------
+try:
+    SRC_PATH = Path(__file__).resolve().parents[1] / "src"
+    if str(SRC_PATH) not in sys.path:
+        sys.path.insert(0, str(SRC_PATH))
+    snapshot = importlib.import_module("10_create_snapshot")
+except Exception as e:
+    logger.error(f"❌ Import du script de snapshot impossible : {e}")
+    exit(1)
+
+# ----------------------------------------------------------------------
+# Restauration du dernier snapshot et contrôle des contenus
+# ----------------------------------------------------------------------
+try:
+    manifests = sorted(
+        snapshot.MANIFESTS_DIR.glob("*.json"),
+        key=lambda path: json.loads(path.read_text())["created_at"],
+    )
+    assert manifests, "❌ Aucun manifeste de snapshot trouvé"
+    manifest_path = manifests[-1]
+    manifest = json.loads(manifest_path.read_text())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target_path = Path(tmp_dir) / "restored.duckdb"
+        skipped = snapshot.restore_snapshot(manifest_path, target_path)
+
+        restored = duckdb.connect(str(target_path), read_only=True)
+        for name, table in manifest["tables"].items():
+            restored_digest = snapshot.content_digest(restored, f'"{name}"')
+            object_digest = snapshot.content_digest(restored, f"read_parquet('{snapshot.SNAPSHOT_DIR / table['object']}')")
+            assert restored_digest == object_digest, f"❌ Table {name} restaurée avec un contenu différent du snapshot"
+
+        nb_views, nb_indexes = restored.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM duckdb_views() WHERE NOT internal AND NOT temporary),
+                (SELECT COUNT(*) FROM duckdb_indexes())
+        """).fetchone()
+        restored.close()
+
+    expected_views = len(manifest["views"]) - len(skipped)
+    assert nb_views == expected_views, f"❌ Vues restaurées : {nb_views} (attendu : {expected_views})"
+    assert nb_indexes == len(manifest["indexes"]), f"❌ Index restaurés : {nb_indexes} (attendu : {len(manifest['indexes'])})"
+
+    logger.success(
+        f"✅ Snapshot {manifest['snapshot_id']} restauré : {len(manifest['tables'])} table(s), "
+        f"{nb_views} vue(s), {nb_indexes} index conformes."
+    )
+
+except Exception as e:
+    logger.error(f"❌ Erreur lors du test de restauration du snapshot : {e}")
+    exit(1)
+
+# ----------------------------------------------------------------------
+# Vue d'historique sur des fichiers absents : ignorée, le reste est restauré
+# ----------------------------------------------------------------------
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        history_manifest = dict(manifest)
+        history_manifest["views"] = {
+            **manifest["views"],
+            "test_historique": (
+                f"CREATE VIEW test_historique AS SELECT * FROM "
+                f"read_parquet('{Path(tmp_dir).as_posix()}/absent/*/*.parquet', hive_partitioning = true)"
+            ),
+            "test_historique_dernier": "CREATE VIEW test_historique_dernier AS SELECT * FROM test_historique LIMIT 1",
+        }
+        history_manifest_path = Path(tmp_dir) / "manifest.json"
+        history_manifest_path.write_text(json.dumps(history_manifest))
+
+        skipped_history = snapshot.restore_snapshot(history_manifest_path, Path(tmp_dir) / "restored.duckdb")
+        assert sorted(skipped_history) == sorted(skipped + ["test_historique", "test_historique_dernier"]), \
+            f"❌ Vues ignorées inattendues : {skipped_history}"
+
+        restored = duckdb.connect(str(Path(tmp_dir) / "restored.duckdb"), read_only=True)
+        nb_tables = restored.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE NOT internal").fetchone()[0]
+        restored.close()
+    assert nb_tables == len(manifest["tables"]), f"❌ Tables restaurées : {nb_tables} (attendu : {len(manifest['tables'])})"
+
+    logger.success("✅ Vue d'historique indisponible ignorée, tables restaurées.")
+    logger.success("🎯 Test de restauration du snapshot réussi.")
+
+except Exception as e:
+    logger.error(f"❌ Erreur lors du test de restauration avec une vue d'historique : {e}")
+    exit(1)
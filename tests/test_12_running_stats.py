@@ -0,0 +1,125 @@
+# === Script de test 12 - Équivalence des statistiques de prix maintenues ===
+# Ce script vérifie que les statistiques maintenues incrémentalement (price_stats,
+# module running_stats) égalent un recalcul exact : membres identiques aux prix de
+# fusion, puis effectif, moyenne et M2 de chaque groupe égaux aux agrégats exacts.
+# Les z-scores de zscore_prix (mis à jour depuis price_stats en mode incrémental)
+# sont comparés à un calcul exact sur fusion.
+
+import duckdb
+from pathlib import Path
+from loguru import logger
+import sys
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# ----------------------------------------------------------------------
+# Logger
+# ----------------------------------------------------------------------
+logger.remove()
+logger.add(sys.stdout, level="INFO", filter=lambda record: record["level"].name == "INFO")
+logger.add(sys.stderr, level="WARNING")
+
+LOGS_PATH = Path("logs")
+LOGS_PATH.mkdir(parents=True, exist_ok=True)
+logger.add(LOGS_PATH / "test_12_running_stats.log", level="INFO", rotation="500 KB")
+
+# ----------------------------------------------------------------------
+# Connexion à DuckDB
+# ----------------------------------------------------------------------
+try:
+    # Connexion du runner si fournie (tables temporaires visibles), sinon base locale
+    con = globals().get("RUNNER_CON") or duckdb.connect("data/bottleneck.duckdb")
+    logger.info("🧪 Connexion à DuckDB réussie.")
+except Exception as e:
+    logger.error(f"❌ Connexion échouée : {e}")
+    exit(1)
+
+# Écart relatif toléré (même tolérance que DRIFT_TOLERANCE dans running_stats.py)
+TOLERANCE = 1e-9
+
+# ----------------------------------------------------------------------
+# Membres comptabilisés = prix non nuls de fusion
+# ----------------------------------------------------------------------
+try:
+    extra, missing = con.execute("""
+        WITH exact AS (
+            SELECT product_id, CAST(price AS DOUBLE) AS price FROM fusion WHERE price IS NOT NULL
+        )
+        SELECT
+            (SELECT COUNT(*) FROM (SELECT product_id, price FROM price_stats_members EXCEPT ALL SELECT * FROM exact)),
+            (SELECT COUNT(*) FROM (SELECT * FROM exact EXCEPT ALL SELECT product_id, price FROM price_stats_members))
+    """).fetchone()
+    assert extra == 0 and missing == 0, (
+        f"❌ price_stats_members diffère de fusion : {extra} ligne(s) en trop, {missing} manquante(s)"
+    )
+    logger.success("✅ Membres des statistiques conformes à fusion.")
+
+except Exception as e:
+    logger.error(f"❌ Erreur lors du contrôle des membres : {e}")
+    exit(1)
+
+# ----------------------------------------------------------------------
+# (n, moyenne, M2) maintenus = agrégats exacts, par groupe
+# ----------------------------------------------------------------------
+try:
+    rows = con.execute("""
+        WITH grouped AS (
+            SELECT 'global' AS groupe, price FROM price_stats_members
+            UNION ALL
+            SELECT categorie, price FROM price_stats_members WHERE categorie IS NOT NULL
+        ),
+        exact AS (
+            SELECT groupe, COUNT(*) AS n, avg(price) AS mean, COALESCE(var_pop(price), 0) * COUNT(*) AS m2
+            FROM grouped
+            GROUP BY groupe
+        )
+        SELECT e.groupe, e.n, e.mean, e.m2, s.n, s.mean, s.m2
+        FROM exact e
+        FULL JOIN price_stats s USING (groupe)
+    """).fetchall()
+    assert rows, "❌ Table price_stats vide"
+
+    for groupe, n, mean, m2, kept_n, kept_mean, kept_m2 in rows:
+        assert kept_n == n, f"❌ Groupe {groupe} : effectif maintenu {kept_n} ≠ {n}"
+        assert abs(kept_mean - mean) <= TOLERANCE * max(abs(mean), 1.0), (
+            f"❌ Groupe {groupe} : moyenne maintenue {kept_mean} ≠ {mean}"
+        )
+        assert abs(kept_m2 - m2) <= TOLERANCE * max(abs(m2), 1.0), (
+            f"❌ Groupe {groupe} : M2 maintenu {kept_m2} ≠ {m2}"
+        )
+
+    logger.success(f"✅ Statistiques maintenues conformes au recalcul exact ({len(rows)} groupe(s)).")
+
+except Exception as e:
+    logger.error(f"❌ Erreur lors du contrôle des statistiques de prix : {e}")
+    exit(1)
+
+# ----------------------------------------------------------------------
+# Z-scores de zscore_prix = calcul exact sur fusion (z-score global uniquement)
+# ----------------------------------------------------------------------
+try:
+    columns = [row[0] for row in con.execute("DESCRIBE zscore_prix").fetchall()]
+    if columns == ["product_id", "post_title", "price", "z_score", "type"]:
+        nb_rows, nb_fusion, nb_diff = con.execute(f"""
+            WITH exact AS (
+                SELECT product_id, CAST(price AS DOUBLE) AS price,
+                    (CAST(price AS DOUBLE) - avg(CAST(price AS DOUBLE)) OVER ())
+                    / stddev_samp(CAST(price AS DOUBLE)) OVER () AS z_score
+                FROM fusion WHERE price IS NOT NULL
+            )
+            SELECT
+                (SELECT COUNT(*) FROM zscore_prix),
+                (SELECT COUNT(*) FROM exact),
+                (SELECT COUNT(*) FROM exact e LEFT JOIN zscore_prix z USING (product_id)
+                 WHERE z.price IS DISTINCT FROM e.price OR NOT abs(z.z_score - e.z_score) <= {TOLERANCE} * greatest(abs(e.z_score), 1.0))
+        """).fetchone()
+        assert nb_rows == nb_fusion, f"❌ zscore_prix : {nb_rows} ligne(s) (attendu : {nb_fusion})"
+        assert nb_diff == 0, f"❌ zscore_prix : {nb_diff} z-score(s) différent(s) du calcul exact"
+        logger.success(f"✅ Z-scores de zscore_prix conformes au calcul exact ({nb_rows} produit(s)).")
+
+    logger.success("🎯 Test d'équivalence des statistiques de prix réussi.")
+
+except Exception as e:
+    logger.error(f"❌ Erreur lors du contrôle des z-scores : {e}")
+    exit(1)
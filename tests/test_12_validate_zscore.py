@@ -1,6 +1,7 @@
 # === Script 12_test - Validation des fichiers Z-score ===
 # Ce script vérifie les exports des vins millésimés.
 
+import os
 import pandas as pd
 from pathlib import Path
 from loguru import logger
@@ -14,6 +15,13 @@ LOGS_PATH = Path("logs")
 LOGS_PATH.mkdir(parents=True, exist_ok=True)
 logger.add(LOGS_PATH / "test_zscore.log", level="INFO", rotation="500 KB")
 
+# === Réglage de détection (30 millésimés attendus avec le réglage d'origine) ===
+REFERENCE_SETTINGS = (
+    os.getenv("OUTLIER_METHOD", "zscore") == "zscore"
+    and float(os.getenv("OUTLIER_THRESHOLD", "2")) == 2
+    and not os.getenv("OUTLIER_GROUP_BY", "")
+)
+
 # === Chargement ===
 try:
     vins_millesimes_path = Path("data/outputs/vins_millesimes.csv")
@@ -22,7 +30,8 @@ try:
     df = pd.read_csv(vins_millesimes_path)
 
     nb_millesimes = df.shape[0]
-    assert nb_millesimes == 30, f"❌ Nombre de vins millésimés incorrect : {nb_millesimes} (attendu : 30)"
+    if REFERENCE_SETTINGS:
+        assert nb_millesimes == 30, f"❌ Nombre de vins millésimés incorrect : {nb_millesimes} (attendu : 30)"
     logger.success(f"🍷 Nombre de vins millésimés détectés : {nb_millesimes} ✅")
 
     for col in ["price", "z_score"]: